@@ -0,0 +1,132 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from Objects import Simulation, VirtualCity, TIME_CONSTANT
+from Cities import build_test_city, build_grid_city, grid_city_size
+CITIES = {
+    # name: (rows, cols) of a generated grid, None for the test city of simulation_main
+    'test': None,
+    'grid100': (10, 10),
+    'grid1000': (25, 40),
+}
+POPULATIONS = (300, 3000, 30000, 300000, 1000000)
+QUICK_CASES = [('test', 300), ('test', 3000), ('grid100', 3000), ('grid100', 30000)]
+TIMED_PHASES = ('clock', 'attractiveness', 'movement', 'infection')
+
+
+def constant_activity(current_time):
+    return 0.1
+
+
+def make_simulation(city: str, population: int, seed: int = 0) -> Simulation:
+    """a reproducible, built but not yet compiled simulation"""
+    shape = CITIES[city]
+    size = 1000 if shape is None else grid_city_size(*shape)
+    sim = Simulation(time_period=(6 * TIME_CONSTANT, 20 * TIME_CONSTANT), size=size, population=population,
+                     initial_infected=max(1, population // 15), step_length=10, drift_sigma=3,
+                     transport_activity=constant_activity, infection_radius=1.8, risk=0.01, seed=seed)
+    if shape is None:
+        build_test_city(sim)
+    else:
+        build_grid_city(sim, *shape)
+    return sim
+
+
+def _timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run_case(city: str, population: int, ticks: int, warmup: int, seed: int = 0) -> dict:
+    sim = make_simulation(city, population, seed)
+    res = {'city': city, 'population': population, 'regions': len(sim.region_table), 'ticks': ticks,
+           'construction': _timed(VirtualCity.finish_construction, sim),
+           'startup': _timed(sim.initiate_individuals, sim.residential_buildings, sim.non_residential_buildings)}
+    phases = {
+        'clock': sim.advance_clock,
+        'attractiveness': sim.refresh_attractiveness,
+        'movement': lambda: sim.move_all(sim.current_time),
+        'infection': lambda: sim.update_infected(sim),
+    }
+    totals = dict.fromkeys(TIMED_PHASES, 0.)
+    for tick in range(warmup + ticks):
+        for name in TIMED_PHASES:  # the order of Simulation.progress
+            elapsed = _timed(phases[name])
+            if tick >= warmup:
+                totals[name] += elapsed
+    for name in TIMED_PHASES:
+        res[f'tick_{name}'] = totals[name] / ticks
+    res['tick'] = sum(totals.values()) / ticks
+    res['final_infected'] = len(sim.infected_individuals)
+    return res
+
+
+def case_name(city: str, population: int) -> str:
+    return f'{city}/{population}'
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """cases whose per-tick, construction or startup time grew by more than threshold (relative)"""
+    res = []
+    for name, case in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        for metric in ('tick', 'construction', 'startup'):
+            old, new = baseline['cases'][name][metric], case[metric]
+            if new > old * (1 + threshold):
+                res.append(f'{name} {metric}: {old:.6f}s -> {new:.6f}s (+{new / old - 1:.0%})')
+    return res
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Scaling benchmark of Simulation construction, startup and ticks')
+    parser.add_argument('--cities', nargs='*', choices=list(CITIES), help='cities to run (default: quick set)')
+    parser.add_argument('--populations', nargs='*', type=int, help=f'populations to run, e.g. {POPULATIONS}')
+    parser.add_argument('--ticks', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json', help='machine-readable results')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    if args.cities or args.populations:
+        cases = [(city, population) for city in args.cities or list(CITIES)
+                 for population in args.populations or POPULATIONS]
+    else:
+        cases = QUICK_CASES
+    results = {'environment': environment(), 'cases': {}}
+    for city, population in cases:
+        case = run_case(city, population, args.ticks, args.warmup, args.seed)
+        results['cases'][case_name(city, population)] = case
+        print(f'{case_name(city, population):>20}: construction {case["construction"]:.3f}s, '
+              f'startup {case["startup"]:.3f}s, tick {case["tick"] * 1000:.2f}ms '
+              f'(movement {case["tick_movement"] * 1000:.2f}ms, infection {case["tick_infection"] * 1000:.2f}ms)')
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            slower = regressions(results, json.load(file), args.threshold)
+        for line in slower:
+            print('REGRESSION', line)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
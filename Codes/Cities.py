@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import numpy as np
+from Objects import VirtualCity
+CACHE_DIR = '.city_cache'
+TOPOLOGY_VERSION = 3  # bump when the compiled topology format changes, to invalidate cached cities
+
+
+def build_test_city(vcity: VirtualCity):
+    """the 3x3 grid of 4 residential and 5 non-residential buildings used by simulation_main"""
+    R1 = vcity.add_region('R1', (250, 250), 101, 'R')
+    R2 = vcity.add_region('R2', (250, 450), 101, 'R')
+    R3 = vcity.add_region('R3', (250, 650), 101, 'R')
+    R4 = vcity.add_region('R4', (450, 250), 101, 'R')
+    T1 = vcity.add_region('T1', (450, 450), 101, 'T')
+    T2 = vcity.add_region('T2', (450, 650), 101, 'T')
+    T3 = vcity.add_region('T3', (650, 250), 101, 'T')
+    T4 = vcity.add_region('T4', (650, 450), 101, 'T')
+    T5 = vcity.add_region('T5', (650, 650), 101, 'T')
+
+    vcity.build_road({R1: (350, 300), R4: (450, 300)}, 5)
+    vcity.build_road({R2: (350, 500), T1: (450, 500)}, 5)
+    vcity.build_road({R3: (350, 700), T2: (450, 700)}, 5)
+    vcity.build_road({R4: (550, 300), T3: (650, 300)}, 5)
+    vcity.build_road({T1: (550, 500), T4: (650, 500)}, 5)
+    vcity.build_road({T2: (550, 700), T5: (650, 700)}, 5)
+
+    vcity.build_road({R1: (300, 350), R2: (300, 450)}, 5)
+    vcity.build_road({R4: (500, 350), T1: (500, 450)}, 5)
+    vcity.build_road({T3: (700, 350), T4: (700, 450)}, 5)
+    vcity.build_road({R2: (300, 550), R3: (300, 650)}, 5)
+    vcity.build_road({T1: (500, 550), T2: (500, 650)}, 5)
+    vcity.build_road({T4: (700, 550), T5: (700, 650)}, 5)
+
+
+def grid_city_size(rows: int, cols: int, building_size=101, spacing=200, margin=250) -> int:
+    return 2 * margin + (max(rows, cols) - 1) * spacing + building_size
+
+
+def grid_city_definition(rows: int, cols: int, building_size=101, spacing=200, road_width=5, margin=250) -> dict:
+    """
+    A rows x cols grid of buildings, residential and non-residential in a checkerboard pattern, with a road between
+    every pair of horizontal and vertical neighbours (the test city is the 3x3 case up to building types).
+    """
+    buildings, roads = [], []
+    for i in range(rows):
+        for j in range(cols):
+            r_type = 'R' if (i + j) % 2 == 0 else 'T'
+            buildings.append({'name': f'{r_type}{i}_{j}', 'loc': [margin + j * spacing, margin + i * spacing],
+                              'size': building_size, 'type': r_type})
+    last, half = building_size - 1, (building_size - 1) // 2
+    for i in range(rows):
+        for j in range(cols):
+            x, y = margin + j * spacing, margin + i * spacing
+            name = buildings[i * cols + j]['name']
+            if j + 1 < cols:
+                roads.append({'ports': {name: [x + last, y + half],
+                                        buildings[i * cols + j + 1]['name']: [x + spacing, y + half]},
+                              'width': road_width})
+            if i + 1 < rows:
+                roads.append({'ports': {name: [x + half, y + last],
+                                        buildings[(i + 1) * cols + j]['name']: [x + half, y + spacing]},
+                              'width': road_width})
+    return {'size': grid_city_size(rows, cols, building_size, spacing, margin), 'buildings': buildings,
+            'roads': roads}
+
+
+def build_grid_city(vcity: VirtualCity, rows: int, cols: int, building_size=101, spacing=200, road_width=5,
+                    margin=250):
+    add_definition(vcity, grid_city_definition(rows, cols, building_size, spacing, road_width, margin))
+
+
+def read_toml(path: str) -> dict:
+    """tomllib on Python 3.11+, the tomli package before that"""
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        try:
+            import tomli as tomllib
+        except ModuleNotFoundError:
+            raise ImportError(f'reading {path} needs Python 3.11+ or the tomli package; use a .json file instead') \
+                from None
+    with open(path, 'rb') as file:
+        return tomllib.load(file)
+
+
+def read_definition(path: str) -> dict:
+    """a city definition from a .json or .toml file"""
+    if path.endswith('.toml'):
+        return read_toml(path)
+    with open(path) as file:
+        return json.load(file)
+
+
+def validate_definition(definition: dict):
+    """
+    Raise ValueError for anything VirtualCity.add_region/build_road would reject.
+    A definition is {'size': int, 'buildings': [{'name', 'loc': [x, y], 'size', 'type': 'R' or 'T'}, ...],
+    'roads': [{'ports': {building name: [x, y], other building name: [x, y]}, 'width'}, ...]}
+    Every building must lie in [0, size) on both axes; size may be left out, see definition_size().
+    """
+    size = definition.get('size')
+    if size is not None and not size > 0:
+        raise ValueError(f'the city needs a positive size, not {size}')
+    buildings = {}
+    for building in definition.get('buildings', []):
+        name = building['name']
+        if name in buildings:
+            raise ValueError(f'building {name} is defined twice')
+        if building['type'] not in ('R', 'T'):
+            raise ValueError(f'building {name} has unknown type {building["type"]}')
+        if not building['size'] > 0 or len(building['loc']) != 2:
+            raise ValueError(f'building {name} needs a positive size and a 2D loc')
+        if min(building['loc']) < 0 or size is not None and max(building['loc']) + building['size'] > size:
+            raise ValueError(f'building {name} does not fit in a city of size {size}')
+        buildings[name] = building
+    if not any(building['type'] == 'R' for building in buildings.values()):
+        raise ValueError('a city needs at least one residential building')
+    for i, road in enumerate(definition.get('roads', [])):
+        if len(road['ports']) != 2:
+            raise ValueError(f'road {i} must connect exactly two buildings')
+        if not road['width'] > 0:
+            raise ValueError(f'road {i} needs a positive width')
+        for name, pos in road['ports'].items():
+            if name not in buildings:
+                raise ValueError(f'road {i} ends in unknown building {name}')
+            loc, size = buildings[name]['loc'], buildings[name]['size']
+            if not (0 <= pos[0] - loc[0] < size and 0 <= pos[1] - loc[1] < size):
+                raise ValueError(f'road {i} port {pos} lies outside building {name}')
+
+
+def definition_size(definition: dict) -> int:
+    """the size of a definition, by default that of the smallest city holding all its buildings"""
+    if 'size' in definition:
+        return definition['size']
+    return int(np.ceil(max(max(building['loc']) + building['size'] for building in definition['buildings'])))
+
+
+def add_definition(vcity: VirtualCity, definition: dict):
+    """add the buildings and roads of a validated definition to an empty city (without compiling it)"""
+    validate_definition(definition)
+    vcity.size = definition_size(definition)
+    buildings = {building['name']: vcity.add_region(building['name'], tuple(building['loc']), building['size'],
+                                                    building['type'])
+                 for building in definition['buildings']}
+    for road in definition.get('roads', []):
+        vcity.build_road({buildings[name]: tuple(pos) for name, pos in road['ports'].items()}, road['width'])
+
+
+def definition_hash(definition: dict) -> str:
+    content = json.dumps({'version': TOPOLOGY_VERSION, 'definition': definition}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def build_city(vcity: VirtualCity, definition: dict, cache_dir: str | None = CACHE_DIR):
+    """
+    Build and compile a city from its definition. The compiled topology is cached in cache_dir under the hash of the
+    definition, so building the same city again skips construction and route searching entirely.
+    """
+    validate_definition(definition)  # also before a cache hit, cached cities may predate a rule
+    cache_path = os.path.join(cache_dir, f'{definition_hash(definition)}.npz') if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path) as topology:
+            vcity.size = int(topology['city_size'])
+            vcity.load_topology(topology)
+        return
+    add_definition(vcity, definition)
+    VirtualCity.finish_construction(vcity)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = f'{cache_path}.{os.getpid()}.tmp.npz'
+        np.savez_compressed(temporary, **vcity.topology())
+        os.replace(temporary, cache_path)
+
+
+def load_city(vcity: VirtualCity, path: str, cache_dir: str | None = CACHE_DIR):
+    build_city(vcity, read_definition(path), cache_dir)
@@ -0,0 +1,69 @@
+import numpy as np
+from RandomStreams import RandomStreams
+_CELL_OFFSET = 1 << 20  # keeps cell coordinates of agents that drifted off the map positive
+_CELL_SPAN = 1 << 21
+_NEIGHBOURHOOD = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+class CellGrid:
+    """
+    Uniform grid (cell list) over a set of positions, bucketed by group (region index).
+    With cells as wide as the query radius, every pair closer than the radius lies in neighbouring cells.
+    """
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.order = np.zeros(0, dtype=np.int64)
+        self.sorted_keys = np.zeros(0, dtype=np.int64)
+        self.pos = np.zeros((0, 2))
+        self.checked = 0  # candidate pairs distance-tested by the last query
+
+    def _cells(self, pos: np.ndarray) -> np.ndarray:
+        return np.floor(pos / self.cell_size).astype(np.int64) + _CELL_OFFSET
+
+    @staticmethod
+    def _keys(group: np.ndarray, cells: np.ndarray) -> np.ndarray:
+        return (group.astype(np.int64) * _CELL_SPAN + cells[:, 0]) * _CELL_SPAN + cells[:, 1]
+
+    def build(self, pos: np.ndarray, group: np.ndarray):
+        keys = self._keys(group, self._cells(pos))
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+        self.pos = pos
+
+    def query(self, pos: np.ndarray, group: np.ndarray, radius: float):
+        """
+        :return: (query indices, member indices, distances) of every query/member pair in the same group
+                 that are closer than radius
+        """
+        cells = self._cells(pos)
+        query_parts, member_parts = [], []
+        for dx, dy in _NEIGHBOURHOOD:
+            keys = self._keys(group, cells + (dx, dy))
+            lo = np.searchsorted(self.sorted_keys, keys, side='left')
+            counts = np.searchsorted(self.sorted_keys, keys, side='right') - lo
+            total = counts.sum()
+            if total == 0:
+                continue
+            query_index = np.repeat(np.arange(len(pos)), counts)
+            within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            query_parts.append(query_index)
+            member_parts.append(self.order[lo[query_index] + within])
+        self.checked = sum(len(part) for part in query_parts)
+        if not query_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        query_index, member_index = np.concatenate(query_parts), np.concatenate(member_parts)
+        delta = pos[query_index] - self.pos[member_index]
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        close = distance < radius
+        return query_index[close], member_index[close], distance[close]
+
+
+def infection_pairs(infectee: np.ndarray, risk: float, streams: RandomStreams) -> tuple[np.ndarray, np.ndarray]:
+    """
+    One Bernoulli(risk) trial per contact pair.
+    :return: the unique infectees with at least one success, and for each of them the first successful pair
+    """
+    success = np.flatnonzero(streams.infection_block(len(infectee)) < risk)
+    res, first = np.unique(infectee[success], return_index=True)
+    return res, success[first]
+
@@ -0,0 +1,170 @@
+import copy
+import itertools
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from Objects import Simulation, VirtualCity, TIME_CONSTANT
+from RandomStreams import RandomStreams
+from Tool import ConstantActivity  # re-exported, it used to live here
+SWEEP_PARAMETERS = ('risk', 'infection_radius', 'step_length', 'transport_activity')
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+def parameter_grid(grid: dict[str, list]) -> list[dict]:
+    """cartesian product of the swept values, e.g. {'risk': [0.01, 0.02], 'step_length': [5, 10]}"""
+    for name in grid:
+        assert name in SWEEP_PARAMETERS, f'{name} cannot be swept'
+    return [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+
+
+def point_key(point: dict) -> str:
+    return json.dumps(point, sort_keys=True)
+
+
+def run_seed(base_seed: int, point: dict, replicate: int) -> list[int]:
+    # derived from the point itself rather than its position in the grid, so that resumed sweeps reuse the seeds
+    return [base_seed, zlib.crc32(point_key(point).encode()), replicate]
+
+
+def simulate(sim: Simulation, point: dict, seed, days: int, sample_every: int) -> np.ndarray:
+    """run a compiled but not yet populated simulation; returns the infected count every sample_every ticks"""
+    for name, value in point.items():
+        setattr(sim, name, ConstantActivity(value) if name == 'transport_activity' else value)
+    sim.streams = RandomStreams(seed)
+    sim.initiate_individuals(sim.residential_buildings, sim.non_residential_buildings)
+    curve = []
+    tick = 0
+    while sim.current_day < days:
+        sim.progress()
+        if tick % sample_every == 0:
+            curve.append(len(sim.infected_individuals))
+        tick += 1
+    return np.array(curve)
+
+
+_template: Simulation | None = None  # the compiled city of a worker process
+
+
+def _init_worker(template: Simulation):
+    global _template
+    _template = template
+
+
+def _run_task(point: dict, replicate: int, seed, days: int, sample_every: int):
+    return point, replicate, simulate(copy.deepcopy(_template), point, seed, days, sample_every)
+
+
+class EnsembleRunner:
+    """
+    Monte Carlo parameter sweeps over a process pool.
+    The city of the template is compiled once and shipped to every worker, each task copies it and runs one
+    independently seeded simulation. Finished runs are appended to <out_dir>/runs.jsonl as they arrive, so a killed
+    sweep resumes by skipping them. The settings the runs depend on, besides the swept point and the replicate, are
+    kept in <out_dir>/settings.json, and resuming with other settings is refused rather than mixing runs.
+    """
+    def __init__(self, template: Simulation, out_dir: str, days: int, replicates: int,
+                 sample_every: int = TIME_CONSTANT, base_seed: int = 0, workers: int = None):
+        if template.routing is None:
+            VirtualCity.finish_construction(template)
+        assert not template.individuals, 'the template must not be populated yet'
+        template.compile_schedule()  # once, for all runs
+        self.template = template
+        self.out_dir = out_dir
+        self.days = days
+        self.replicates = replicates
+        self.sample_every = sample_every
+        self.base_seed = base_seed
+        self.workers = workers
+        os.makedirs(out_dir, exist_ok=True)
+        self.check_settings()
+
+    @property
+    def runs_path(self):
+        return os.path.join(self.out_dir, 'runs.jsonl')
+
+    @property
+    def settings_path(self):
+        return os.path.join(self.out_dir, 'settings.json')
+
+    def settings(self) -> dict:
+        template = self.template
+        return {'days': self.days, 'sample_every': self.sample_every, 'base_seed': self.base_seed,
+                'time_period': list(template.time_period), 'population': template.population,
+                'initial_infected': template.initial_infected, 'drift_sigma': template.drift_sigma,
+                **{name: getattr(template, name) for name in SWEEP_PARAMETERS if name != 'transport_activity'}}
+
+    def check_settings(self):
+        """record the settings in a new out_dir; raise ValueError if those of an existing one differ"""
+        settings = self.settings()
+        if os.path.exists(self.settings_path):
+            with open(self.settings_path) as file:
+                stored = json.load(file)
+            if stored != settings:
+                changed = sorted(name for name in settings.keys() | stored.keys()
+                                 if stored.get(name) != settings.get(name))
+                raise ValueError(f'{self.out_dir} holds runs with other {", ".join(changed)}; use a new out_dir')
+        elif os.path.exists(self.runs_path):
+            raise ValueError(f'{self.out_dir} holds runs of unknown settings; use a new out_dir')
+        else:
+            with open(self.settings_path, 'w') as file:
+                json.dump(settings, file, indent=2)
+
+    def completed(self) -> dict[tuple[str, int], np.ndarray]:
+        res = {}
+        if os.path.exists(self.runs_path):
+            with open(self.runs_path) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:  # a line cut short by a killed sweep
+                        continue
+                    res[(record['key'], record['replicate'])] = np.array(record['curve'])
+        return res
+
+    def run(self, grid: dict[str, list]):
+        """yields (point, replicate, curve) of every run as it finishes, skipping runs completed earlier"""
+        done = self.completed()
+        tasks = [(point, replicate) for point in parameter_grid(grid) for replicate in range(self.replicates)
+                 if (point_key(point), replicate) not in done]
+        if not tasks:
+            return
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.template,)) as executor, \
+                open(self.runs_path, 'a') as file:
+            futures = [executor.submit(_run_task, point, replicate, run_seed(self.base_seed, point, replicate),
+                                       self.days, self.sample_every)
+                       for point, replicate in tasks]
+            for future in as_completed(futures):
+                point, replicate, curve = future.result()
+                file.write(json.dumps({'key': point_key(point), 'point': point, 'replicate': replicate,
+                                       'curve': curve.tolist()}) + '\n')
+                file.flush()
+                yield point, replicate, curve
+
+    def aggregate(self) -> dict[str, dict[str, np.ndarray]]:
+        """mean and QUANTILES curves of every completed parameter point"""
+        curves: dict[str, list[np.ndarray]] = {}
+        for (key, _), curve in self.completed().items():
+            curves.setdefault(key, []).append(curve)
+        res = {}
+        for key, point_curves in curves.items():
+            stacked = np.stack(point_curves)
+            res[key] = {'runs': len(point_curves), 'mean': stacked.mean(axis=0)}
+            for q, curve in zip(QUANTILES, np.quantile(stacked, QUANTILES, axis=0)):
+                res[key][f'q{q:g}'] = curve
+        return res
+
+
+if __name__ == '__main__':
+    class _Test:
+        from Cities import build_test_city
+        sim = Simulation(time_period=(6 * TIME_CONSTANT, 20 * TIME_CONSTANT), size=1000, population=300,
+                         initial_infected=20, step_length=10, drift_sigma=3, transport_activity=ConstantActivity(0.1),
+                         infection_radius=1.8, risk=0.01)
+        build_test_city(sim)
+        runner = EnsembleRunner(sim, 'ensemble_output', days=2, replicates=2)
+        for _point, _replicate, _curve in runner.run({'risk': [0.01, 0.05]}):
+            print(_point, _replicate, _curve[-1])
+        for _key, _summary in runner.aggregate().items():
+            print(_key, _summary['mean'][-1], _summary['q0.95'][-1])
@@ -0,0 +1,147 @@
+import json
+import os
+import numpy as np
+SEED = -1  # infector of the individuals infected before the log was attached
+INFECTION_COLUMNS = {'infector': np.int64, 'infectee': np.int64, 'region': np.int32, 'tick': np.int64,
+                     'distance': np.float32}
+CONTACT_COLUMNS = {'source': np.int64, 'target': np.int64, 'region': np.int32, 'tick': np.int64,
+                   'distance': np.float32}
+
+
+class _ColumnBuffer:
+    """preallocated columns of one table, spilled to <out_dir>/<table>_<column>.bin whenever they fill up"""
+    def __init__(self, out_dir: str, table: str, columns: dict, capacity: int):
+        self.paths = {column: os.path.join(out_dir, f'{table}_{column}.bin') for column in columns}
+        self.buffers = {column: np.zeros(capacity, dtype=dtype) for column, dtype in columns.items()}
+        self.capacity = capacity
+        self.filled = 0
+        self.rows = 0
+        for path in self.paths.values():
+            open(path, 'wb').close()
+
+    def append(self, **columns):
+        count = len(next(iter(columns.values())))
+        done = 0
+        while done < count:
+            take = min(count - done, self.capacity - self.filled)
+            for column, values in columns.items():
+                self.buffers[column][self.filled:self.filled + take] = values[done:done + take]
+            self.filled += take
+            done += take
+            if self.filled == self.capacity:
+                self.flush()
+        self.rows += count
+
+    def flush(self):
+        for column, buffer in self.buffers.items():
+            with open(self.paths[column], 'ab') as file:
+                buffer[:self.filled].tofile(file)
+        self.filled = 0
+
+
+class EventLog:
+    """
+    Append-only log of infection events (infector, infectee, region, tick, distance) and, optionally, of a random
+    sample of the close contacts the infection step tested. Both tables are preallocated columns of `capacity` rows
+    spilled to raw binary files in out_dir whenever they fill up, so memory stays bounded however long the run.
+    Attach with Simulation.event_log = EventLog(sim, ...) after populating; the individuals infected by then are
+    logged as seeded (infector SEED). Read back with load_events().
+    The contact sample uses its own generator, so logging never changes a run.
+    """
+    def __init__(self, sim, out_dir: str, capacity: int = 1 << 16, contact_fraction: float = 0., seed=None):
+        self.sim = sim
+        self.out_dir = out_dir
+        self.contact_fraction = contact_fraction
+        self.rng = np.random.default_rng(seed)
+        os.makedirs(out_dir, exist_ok=True)
+        self.infection_buffer = _ColumnBuffer(out_dir, 'infection', INFECTION_COLUMNS, capacity)
+        self.contact_buffer = _ColumnBuffer(out_dir, 'contact', CONTACT_COLUMNS, capacity)
+        store = sim.store
+        np.save(os.path.join(out_dir, 'home.npy'), store.home[:store.count])
+        with open(os.path.join(out_dir, 'schema.json'), 'w') as file:
+            json.dump({'infection': {column: np.dtype(dtype).str for column, dtype in INFECTION_COLUMNS.items()},
+                       'contact': {column: np.dtype(dtype).str for column, dtype in CONTACT_COLUMNS.items()},
+                       'population': store.count, 'contact_fraction': contact_fraction}, file)
+        seeded = np.flatnonzero(store.infected[:store.count])
+        self.infections(np.full(len(seeded), SEED), seeded, np.full(len(seeded), np.nan))
+
+    def infections(self, infector, infectee, distance):
+        infectee = np.asarray(infectee, dtype=np.int64)
+        if len(infectee) == 0:
+            return
+        self.infection_buffer.append(infector=np.asarray(infector), infectee=infectee,
+                                     region=self.sim.store.current[infectee],
+                                     tick=np.full(len(infectee), self.sim.elapsed_ticks),
+                                     distance=np.asarray(distance))
+
+    def contacts(self, source: np.ndarray, target: np.ndarray, distance: np.ndarray):
+        if self.contact_fraction <= 0 or len(source) == 0:
+            return
+        kept = np.flatnonzero(self.rng.random(len(source)) < self.contact_fraction)
+        self.contact_buffer.append(source=source[kept], target=target[kept],
+                                   region=self.sim.store.current[source[kept]],
+                                   tick=np.full(len(kept), self.sim.elapsed_ticks), distance=distance[kept])
+
+    def flush(self):
+        self.infection_buffer.flush()
+        self.contact_buffer.flush()
+
+    def close(self):
+        self.flush()
+
+
+def load_events(out_dir: str) -> dict:
+    """{'infection': columns, 'contact': columns, 'home': home of every individual}"""
+    with open(os.path.join(out_dir, 'schema.json')) as file:
+        schema = json.load(file)
+    res = {table: {column: np.fromfile(os.path.join(out_dir, f'{table}_{column}.bin'), dtype=dtype)
+                   for column, dtype in schema[table].items()}
+           for table in ('infection', 'contact')}
+    res['home'] = np.load(os.path.join(out_dir, 'home.npy'))
+    return res
+
+
+def infection_ticks(events: dict) -> np.ndarray:
+    """the tick every individual was infected at, -1 for those never infected"""
+    res = np.full(len(events['home']), -1, dtype=np.int64)
+    res[events['infection']['infectee']] = events['infection']['tick']
+    return res
+
+
+def secondary_infections(events: dict) -> np.ndarray:
+    """the number of individuals every infected individual infected, in the order of the log"""
+    infection = events['infection']
+    caused = np.bincount(infection['infector'][infection['infector'] != SEED], minlength=len(events['home']))
+    return caused[infection['infectee']]
+
+
+def generation_intervals(events: dict) -> np.ndarray:
+    """ticks from the infection of the infector to that of the infectee, for every non-seeded infection"""
+    infection = events['infection']
+    transmitted = infection['infector'] != SEED
+    return infection['tick'][transmitted] - infection_ticks(events)[infection['infector'][transmitted]]
+
+
+def attack_rates(events: dict) -> dict[str, float]:
+    """
+    household: secondary attack rate within homes, i.e. infections by a housemate per housemate still susceptible
+               when the infector was infected
+    non_household: share of the individuals susceptible at the start that were infected by someone outside their home
+    """
+    infection, home = events['infection'], events['home']
+    ticks = infection_ticks(events)
+    transmitted = infection['infector'] != SEED
+    infector, infectee = infection['infector'][transmitted], infection['infectee'][transmitted]
+    in_household = home[infector] == home[infectee]
+
+    # housemates of every case still susceptible at its infection: individuals sorted by (home, infection tick)
+    never = ticks.max(initial=0) + 1
+    keys = home.astype(np.int64) * (never + 1) + np.where(ticks < 0, never, ticks)
+    keys.sort()
+    cases = infection['infectee']
+    home_end = np.searchsorted(keys, (home[cases].astype(np.int64) + 1) * (never + 1))
+    exposed = home_end - np.searchsorted(keys, home[cases].astype(np.int64) * (never + 1) + ticks[cases],
+                                         side='right')
+    initially_susceptible = len(home) - np.count_nonzero(~transmitted)
+    return {'household': float(in_household.sum() / max(exposed.sum(), 1)),
+            'non_household': float((~in_household).sum() / max(initially_susceptible, 1))}
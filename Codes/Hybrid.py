@@ -0,0 +1,258 @@
+import time
+import numpy as np
+from Objects import Simulation, VirtualCity, TIME_CONSTANT
+from Contact import CellGrid, infection_pairs
+from EventLog import SEED
+from Ensemble import simulate, QUANTILES
+
+
+def _occupant_sd(region_size: np.ndarray, drift_sigma: float) -> np.ndarray:
+    """per axis sd of a settled individual around its building's centre in the long run, nan for roads"""
+    b = 1 - 2 / region_size
+    return drift_sigma * np.sqrt(b ** 2 / (1 - b ** 2))
+
+
+def _pair_probability(sd: np.ndarray, radius: float) -> np.ndarray:
+    """probability that two independent occupants are within radius, 0 for roads"""
+    return np.nan_to_num(1 - np.exp(-radius ** 2 / (4 * sd ** 2)))
+
+
+class HybridSimulation(Simulation):
+    """
+    Simulation in which the settled occupants of a building (those not transporting) are a well-mixed compartment
+    instead of explicit agents: they do not drift and have no pairwise contacts. Only travellers stay explicit.
+
+    The compartments are calibrated to the agent kernel. mixing[region] is the probability that two occupants are
+    within infection_radius in a tick, measured by measure_mixing() over a simulated day of the agent engine on the
+    same city (calibrate()); it is measured on first use, and again whenever a parameter it depends on changed, and
+    kept per parameter set in `calibration`, which simulations may share. Each close pair infects with probability
+    risk per tick, as in the agent engine. Per building the number of new infections is one binomial draw, and the
+    infected occupants are chosen uniformly.
+    A traveller inside a building meets occupants with the stationary distribution of drift: a normal of sd s per
+    axis around the centre, where s^2 = drift_sigma^2 b^2 / (1 - b^2) and b = 1 - 2 / size (see Crowd._leap_terms),
+    so it has a given occupant within r with probability about pi r^2 times the normal density at its position.
+
+    An occupant materializes when it departs, at a position drawn from that stationary distribution, and
+    dematerializes on arrival. The agent engine lets an arrival relax from the door over about size / 2 ticks, which
+    the compartments skip.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calibration: dict[tuple, np.ndarray] = {}  # mixing per calibration_key()
+        self.calibration_ticks: int | None = None  # ticks of agent engine to measure mixing over, None for a day
+        self.calibration_population = 5000  # at most, the mixing of a pair does not depend on it
+        self.calibration_seed = 0
+
+    @property
+    def occupant_sd(self) -> np.ndarray:
+        """s of every region, nan for roads"""
+        return _occupant_sd(self.region_size, self.drift_sigma)
+
+    def calibration_key(self) -> tuple:
+        """the parameters mixing depends on"""
+        return self.infection_radius, self.drift_sigma, self.step_length, self.transport_activity, self.time_period
+
+    @property
+    def mixing(self) -> np.ndarray:
+        """probability that two occupants of a region are within infection_radius in a tick, see calibrate()"""
+        key = self.calibration_key()
+        if key not in self.calibration:
+            self.calibrate()
+        return self.calibration[key]
+
+    def calibrate(self):
+        """measure mixing on an agent-engine twin of this city, with its own random streams"""
+        start, end = self.time_period
+        twin = Simulation(self.time_period, self.size, min(self.population, self.calibration_population), 0,
+                          self.step_length, self.drift_sigma, self.transport_activity, self.infection_radius, risk=0,
+                          seed=self.calibration_seed)
+        twin.raster_cell = self.raster_cell
+        twin.load_topology(self.topology())
+        for building, copy in zip(self.buildings, twin.buildings):
+            if getattr(building.attract_func, '__self__', None) is not building:  # not the class default
+                copy.attract_func = building.attract_func
+        twin.initiate_individuals(twin.residential_buildings, twin.non_residential_buildings)
+        ticks = self.calibration_ticks if self.calibration_ticks is not None else end - start
+        self.calibration[self.calibration_key()] = measure_mixing(twin, ticks)
+
+    def quiescent_horizon(self, max_ticks: int) -> int:
+        """the compartments mix every tick, so no stretch is quiescent"""
+        return 0
+
+    def drift_all(self):
+        """only the travellers exist as positions"""
+        store = self.store
+        moving = np.flatnonzero(store.transporting[:store.count])
+        store.pos[moving] += self.streams.drift_block(len(moving), self.drift_sigma)
+
+    def depart_all(self, individuals: np.ndarray):
+        """materialize the departing occupants somewhere in their building, then depart as usual"""
+        store = self.store
+        current = store.current[individuals]
+        half = (self.vcity.region_size[current, None] - 1) / 2
+        offset = self.streams.drift.normal(0, 1, (len(individuals), 2)) * self.occupant_sd[current, None]
+        store.pos[individuals] = self.vcity.region_cntr[current] + np.clip(offset, -half, half)
+        super().depart_all(individuals)
+
+    def _occupant_contact(self, travellers: np.ndarray) -> np.ndarray:
+        """probability that a given occupant of the traveller's building is within infection_radius of it"""
+        store = self.store
+        current = store.current[travellers]
+        sd = self.occupant_sd[current]
+        squared = ((store.pos[travellers] - self.vcity.region_cntr[current]) ** 2).sum(axis=1)
+        density = np.exp(-squared / (2 * sd ** 2)) / (2 * np.pi * sd ** 2)
+        return np.minimum(np.pi * self.infection_radius ** 2 * density, 1)
+
+    def update_infected(self, virus):
+        self.new_infected = []
+        store, rng = self.store, self.streams.infection
+        infected = store.infected[:store.count]
+        transporting = store.transporting[:store.count]
+        current = store.current[:store.count]
+        region_count = len(self.region_table)
+        susceptible = np.bincount(current[~transporting & ~infected], minlength=region_count)
+        sources = np.bincount(current[~transporting & infected], minlength=region_count)
+
+        # travellers among themselves, with the explicit kernel
+        travellers = np.flatnonzero(transporting)
+        explicit_sources, explicit_targets = travellers[infected[travellers]], travellers[~infected[travellers]]
+        infectees, infectors = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        if len(explicit_sources) and len(explicit_targets):
+            grid = CellGrid(virus.infection_radius)
+            grid.build(store.pos[explicit_targets], current[explicit_targets])
+            source, close, _ = grid.query(store.pos[explicit_sources], current[explicit_sources],
+                                          virus.infection_radius)
+            hit, pair = infection_pairs(close, virus.risk, self.streams)
+            infectees.append(explicit_targets[hit])
+            infectors.append(explicit_sources[source[pair]])
+
+        # travellers inside buildings and the occupants there
+        visiting = travellers[np.isfinite(self.occupant_sd[current[travellers]])]
+        visiting_risk = virus.risk * self._occupant_contact(visiting)
+        visiting_infected = infected[visiting]
+        exposed = visiting[~visiting_infected]
+        exposed = exposed[np.isin(exposed, np.concatenate(infectees), invert=True)]
+        exposed_risk = virus.risk * self._occupant_contact(exposed)
+        caught = rng.random(len(exposed)) >= (1 - exposed_risk) ** sources[current[exposed]]
+        infectees.append(exposed[caught])
+        infectors.append(np.full(np.count_nonzero(caught), SEED))  # an occupant, chosen below if logging
+
+        # occupants: the log of the probability of escaping every occupant and infected visitor of the building
+        escape = sources * np.log1p(-virus.risk * self.mixing) \
+            + np.bincount(current[visiting[visiting_infected]], np.log1p(-visiting_risk[visiting_infected]),
+                          minlength=region_count)
+        new_cases = np.zeros(region_count, dtype=np.int64)
+        hit = np.flatnonzero((susceptible > 0) & (escape < 0))
+        new_cases[hit] = rng.binomial(susceptible[hit], -np.expm1(escape[hit]))
+        for region in np.flatnonzero(new_cases):
+            candidates = self.region_table[region].normal_individuals.indices()
+            candidates = candidates[~transporting[candidates]]
+            infectees.append(rng.choice(candidates, new_cases[region], replace=False))
+            infectors.append(np.full(new_cases[region], SEED))
+
+        infectees, infectors = np.concatenate(infectees), np.concatenate(infectors)
+        for i in infectees:
+            self.views[i].infect()
+        if self.event_log is not None:
+            self._attribute(infectees, infectors, visiting[visiting_infected], visiting_risk[visiting_infected])
+            self.event_log.infections(infectors, infectees, np.full(len(infectees), np.nan))
+
+    def _attribute(self, infectees: np.ndarray, infectors: np.ndarray, visitors: np.ndarray, visitor_risk):
+        """fill in the infectors of compartment infections, drawn in proportion to their pair probabilities"""
+        rng, store = self.streams.infection, self.store
+        for i in np.flatnonzero(infectors == SEED):
+            region = store.current[infectees[i]]
+            occupants = self.region_table[region].infected_individuals.indices()
+            occupants = occupants[~store.transporting[occupants] & (occupants != infectees[i])]
+            candidates = np.concatenate([occupants, visitors[store.current[visitors] == region]])
+            weights = np.concatenate([np.full(len(occupants), self.risk * self.mixing[region]),
+                                      visitor_risk[store.current[visitors] == region]])
+            if store.transporting[infectees[i]]:  # a visitor is only infected by occupants
+                candidates, weights = occupants, weights[:len(occupants)]
+            if weights.sum() > 0:
+                infectors[i] = rng.choice(candidates, p=weights / weights.sum())
+
+
+def measure_mixing(sim: Simulation, ticks: int) -> np.ndarray:
+    """
+    Advance a populated agent-engine simulation by `ticks` ticks and count, in every building, how often two settled
+    occupants were within infection_radius of each other. Measure at least a whole simulated day: occupants pack
+    more densely near the door while they arrive, so a shorter stretch over- or underestimates the daily mean.
+    :return: per region the observed probability of that per pair and tick; for buildings that never had two
+             occupants, that of two independent draws from the stationary drift distribution
+    """
+    store = sim.store
+    region_count = len(sim.region_table)
+    close_pairs, pairs = np.zeros(region_count), np.zeros(region_count)
+    for _ in range(ticks):
+        sim.tick()
+        settled = np.flatnonzero(~store.transporting[:store.count])
+        current = store.current[settled]
+        grid = CellGrid(sim.infection_radius)
+        grid.build(store.pos[settled], current)
+        query, member, _ = grid.query(store.pos[settled], current, sim.infection_radius)
+        close_pairs += np.bincount(current[query[query != member]], minlength=region_count)
+        occupants = np.bincount(current, minlength=region_count).astype(float)
+        pairs += occupants * (occupants - 1)
+    analytic = _pair_probability(_occupant_sd(sim.region_size, sim.drift_sigma), sim.infection_radius)
+    return np.where(pairs > 0, close_pairs / np.maximum(pairs, 1), analytic)
+
+
+def validate(make_simulation, replicates: int = 8, days: int = 3, sample_every: int = TIME_CONSTANT,
+             base_seed: int = 0, tolerance: float = 0.05) -> dict:
+    """
+    Epidemic curves of the agent engine and the hybrid engine over the same seeds.
+    make_simulation(cls) must return an unpopulated simulation of class cls (Simulation or HybridSimulation); the
+    hybrid runs share one calibration.
+    :return: per engine the mean and QUANTILES curves of the infected count and the seconds per run (the hybrid
+             calibration is reported separately), and
+             divergence: the largest gap between the mean curves, as a share of the population,
+             passed: whether divergence is at most tolerance
+    """
+    res = {}
+    calibration = {}
+    for name, cls in (('agent', Simulation), ('hybrid', HybridSimulation)):
+        curves = []
+        start = time.perf_counter()
+        for replicate in range(replicates):
+            sim = make_simulation(cls)
+            VirtualCity.finish_construction(sim)
+            if cls is HybridSimulation:
+                sim.calibration = calibration
+                if not calibration:
+                    calibrating = time.perf_counter()
+                    sim.calibrate()
+                    res['calibration_seconds'] = time.perf_counter() - calibrating
+                    start += res['calibration_seconds']
+            curves.append(simulate(sim, {}, [base_seed, replicate], days, sample_every))
+        length = min(len(curve) for curve in curves)
+        stacked = np.stack([curve[:length] for curve in curves])
+        res[name] = {'mean': stacked.mean(axis=0), 'seconds': (time.perf_counter() - start) / replicates}
+        for q, curve in zip(QUANTILES, np.quantile(stacked, QUANTILES, axis=0)):
+            res[name][f'q{q:g}'] = curve
+    length = min(len(res['agent']['mean']), len(res['hybrid']['mean']))
+    population = make_simulation(Simulation).population
+    res['divergence'] = float(np.abs(res['hybrid']['mean'][:length] - res['agent']['mean'][:length]).max(initial=0)
+                              / population)
+    res['tolerance'] = tolerance
+    res['passed'] = res['divergence'] <= tolerance
+    return res
+
+
+if __name__ == '__main__':
+    class _Test:
+        from Cities import build_test_city
+        from Tool import ConstantActivity
+
+        def make(cls, build_test_city=build_test_city, activity=ConstantActivity(0.1)):
+            sim = cls(time_period=(6 * TIME_CONSTANT, 20 * TIME_CONSTANT), size=1000, population=3000,
+                      initial_infected=20, step_length=10, drift_sigma=3, transport_activity=activity,
+                      infection_radius=1.8, risk=0.001)
+            build_test_city(sim)
+            return sim
+        result = validate(make, replicates=6, days=2)
+        for _name in ('agent', 'hybrid'):
+            print(f'{_name:>6}: {result[_name]["seconds"]:.2f}s per run, infected every hour',
+                  result[_name]['mean'].round().astype(int).tolist())
+        print(f'calibration {result["calibration_seconds"]:.2f}s, divergence {result["divergence"]:.3f}',
+              'passed' if result['passed'] else 'FAILED', f'(tolerance {result["tolerance"]})')
@@ -1,10 +1,23 @@
-import random
-import time
+import json
+from typing import TYPE_CHECKING
 import numpy as np
-from Tool import unit_vector, norm
+from Tool import ConstantActivity, unit_vectors, norm
+from Population import Population, MemberSet, NO_REGION
+from Contact import CellGrid, infection_pairs
+from Routing import RoutingTable, UNREACHABLE
+from Raster import RegionRaster
+from Schedule import AttractivenessSchedule
+from RandomStreams import RandomStreams
+if TYPE_CHECKING:  # the optional instruments, imported by whoever attaches them
+    from Profiler import PhaseProfiler
+    from EventLog import EventLog
+    from Transit import TransitScheduler
+    from Recorder import MetricsRecorder
+    from Telemetry import TelemetryServer
 NORMAL = 'normal'
 INFECTED = 'infected'
 TIME_CONSTANT = 360  # 1 hours contains 360 time units
+LEAP_MARGIN = 6  # standard deviations of drift a fast-forward leap allows for when keeping pairs apart
 
 
 class Protocol:
@@ -12,7 +25,8 @@ class Protocol:
         self.region1 = region1
         self.region2 = region2
         self.pos = pos
-        self.connect_dict: dict[Region, dict[Region, int]] = {}
+        self._connect_dict: dict[Region, dict[Region, int]] | None = None
+        self.index = region1.vcity.register_protocol(self) if region1.vcity is not None else None
 
     def other_side(self, origin: 'Region') -> 'Region':
         if origin == self.region1:
@@ -20,7 +34,20 @@ class Protocol:
         else:
             return self.region1
 
+    @property
+    def connect_dict(self) -> dict['Region', dict['Region', int]]:
+        """{side: {region: distance}} of regions accessible through this protocol from each side, built on demand"""
+        if self._connect_dict is None:
+            vcity = self.region1.vcity
+            self._connect_dict = {
+                side: {vcity.region_table[region]: distance
+                       for region, distance in vcity.routing.connect_distances(self.index, side.index).items()}
+                for side in (self.region1, self.region2)
+            }
+        return self._connect_dict
+
     def accessible_from(self, origin: 'Region', track: list['Region'] = None):
+        # reference path enumeration (exponential); cities use the compiled RoutingTable instead
         if track is None:
             track = []
         # print(f'Getting view form {origin} to {self}')
@@ -35,10 +62,6 @@ class Protocol:
     def __repr__(self):
         return f'Protocol between {repr(self.region1)} and {repr(self.region2)}'
 
-    def finish_construction(self):
-        self.connect_dict[self.region1] = self.accessible_from(self.region1)
-        self.connect_dict[self.region2] = self.accessible_from(self.region2)
-
 
 class Region:
     @staticmethod
@@ -51,12 +74,14 @@ class Region:
         self.na = name
         self.vcity = vcity
         self.add_self = add_self
+        self.index = vcity.register_region(self) if vcity is not None else None
         self.protocols: list[Protocol] = []
-        self.accessible: dict[Region, int] = {}
-        self.normal_individuals: list[Individual] = []
-        self.infected_individuals: list[Individual] = []
+        self._accessible: dict[Region, int] | None = None
+        self.normal_individuals = MemberSet()
+        self.infected_individuals = MemberSet()
 
     def accessible_from(self, origin: Protocol = None, root_track=None) -> dict['Region', int]:
+        # reference path enumeration (exponential); cities use the compiled RoutingTable instead
         # print(f'Getting Accessible Regions From {origin} in {self}')
         if root_track is None:
             root_track = []
@@ -73,18 +98,21 @@ class Region:
         return res
 
     def finish_construction(self):
-        for protocol in self.protocols:
-            protocol.finish_construction()
-        self.accessible = self.accessible_from()
+        self._accessible = None
+
+    @property
+    def accessible(self) -> dict['Region', int]:
+        """{region: distance} of the buildings reachable from here, read from the routing table on demand"""
+        if self._accessible is None:
+            self._accessible = {self.vcity.region_table[region]: distance
+                                for region, distance in self.vcity.routing.accessible(self.index).items()}
+        return self._accessible
 
     def find_protocol(self, target: 'Region') -> Protocol:
         assert target != self
-        candidates = []
-        for protocol in self.protocols:
-            if target in protocol.connect_dict[self].keys():
-                candidates.append((protocol, protocol.connect_dict[self][target]))
-        candidates.sort(key=lambda x: x[1])
-        return candidates[0][0]
+        protocol_index = self.vcity.routing.next_hop(self.index, target.index)
+        assert protocol_index != UNREACHABLE, f'{target} is not accessible from {self}'
+        return self.vcity.protocol_table[protocol_index]
 
     def __repr__(self):
         return self.na
@@ -99,23 +127,57 @@ class Region:
     def __contains__(self, pos: np.ndarray):
         pass
 
+    def contains_many(self, pos: np.ndarray) -> np.ndarray:
+        """batched __contains__ over an (n, 2) array of positions"""
+        return np.zeros(len(pos), dtype=bool)
+
+    def nearest_many(self, pos: np.ndarray) -> np.ndarray:
+        """a point of the region close to each position"""
+        return pos
+
     def update_infected(self, virus: 'Virus'):
-        for individual1 in self.infected_individuals:
-            for individual2 in self.normal_individuals:
-                if norm(individual1.pos - individual2.pos) < virus.infection_radius:
-                    random.seed(time.perf_counter())
-                    individual2.infected_state = random.choices([INFECTED, NORMAL], cum_weights=[virus.risk, 1])[0]
-                    if individual2.infected_state == INFECTED:
-                        individual2.crowd.normal_individuals.remove(individual2)
-                        individual2.crowd.infected_individuals.append(individual2)
-                        self.normal_individuals.remove(individual2)
-                        self.infected_individuals.append(individual2)
+        # only individuals infected before this update are contagious; each close pair is one Bernoulli trial
+        sources, targets = list(self.infected_individuals), list(self.normal_individuals)
+        if not sources or not targets:
+            return
+        crowd = targets[0].crowd
+        if virus.brute_force:
+            infectees, infectors, distances = [], [], []
+            for individual2 in targets:
+                for individual1 in sources:  # the first successful contact infects, as any() would stop there
+                    distance = norm(individual1.pos - individual2.pos)
+                    if distance < virus.infection_radius and crowd.streams.infection.random() < virus.risk:
+                        infectees.append(individual2)
+                        infectors.append(individual1.index)
+                        distances.append(distance)
+                        break
+            checked = len(sources) * len(targets)
+        else:
+            store = crowd.store
+            source_index = self.infected_individuals.indices()
+            target_index = self.normal_individuals.indices()
+            grid = CellGrid(virus.infection_radius)
+            grid.build(store.pos[target_index], np.zeros(len(targets), dtype=np.int64))
+            source, close, distance = grid.query(store.pos[source_index], np.zeros(len(sources), dtype=np.int64),
+                                                 virus.infection_radius)
+            hit, pair = infection_pairs(close, virus.risk, crowd.streams)
+            infectees = [targets[i] for i in hit]
+            infectors, distances = source_index[source[pair]], distance[pair]
+            if crowd.event_log is not None:
+                crowd.event_log.contacts(source_index[source], target_index[close], distance)
+            checked = grid.checked
+        for individual in infectees:
+            individual.infect()
+        if crowd.event_log is not None:
+            crowd.event_log.infections(infectors, [individual.index for individual in infectees], distances)
+        if crowd.profiler is not None:
+            crowd.profiler.count('pair_checks', checked)
 
     def add_individual(self, indiv: 'Individual'):
         if indiv.infected_state == NORMAL:
-            self.normal_individuals.append(indiv)
+            self.normal_individuals.add(indiv)
         else:
-            self.infected_individuals.append(indiv)
+            self.infected_individuals.add(indiv)
 
     def remove_individual(self, indiv: 'Individual'):
         if indiv.infected_state == NORMAL:
@@ -141,18 +203,32 @@ class Building(Region):
     def update_attractiveness(self, current_time):
         self.attractiveness = self.attract_func(current_time)
 
-    def rand_location(self) -> np.ndarray:
-        y_sigma = x_sigma = (self.size - 1) / 6
-        x_mu, y_mu = self.cntr
-        random.seed(time.perf_counter())
-        res = (random.gauss(x_mu, x_sigma), random.gauss(y_mu, y_sigma))
-        while res not in self:
-            res = (random.gauss(x_mu, x_sigma), random.gauss(y_mu, y_sigma))
-        return np.array(np.round_(res))
+    @staticmethod
+    def rand_locations(loc: np.ndarray, size: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        a location in the building of each individual, from a normal around its centre with 1/6 of its size as sd,
+        given the loc and size of each one's building
+        """
+        cntr = loc + (size[:, None] - 1) / 2
+        sigma = (size[:, None] - 1) / 6
+        res = rng.normal(cntr, sigma)
+        rejected = np.flatnonzero(~np.all((loc <= res) & (res < loc + size[:, None]), axis=1))
+        while len(rejected):
+            res[rejected] = rng.normal(cntr[rejected], sigma[rejected])
+            rel = res[rejected] - loc[rejected]
+            rejected = rejected[~np.all((0 <= rel) & (rel < size[rejected, None]), axis=1)]
+        return np.round(res)
 
     def __contains__(self, pos: np.ndarray):
         return 0 <= (pos - self.loc)[0] < self.size and 0 <= (pos - self.loc)[1] < self.size
 
+    def contains_many(self, pos: np.ndarray) -> np.ndarray:
+        rel = pos - self.loc
+        return np.all((0 <= rel) & (rel < self.size), axis=1)
+
+    def nearest_many(self, pos: np.ndarray) -> np.ndarray:
+        return np.clip(pos, self.loc, self.loc + self.size - 1)
+
 
 class StraightRoad(Region):
     def __init__(self, width, vcity: 'VirtualCity', r1_name, r2_name):
@@ -166,6 +242,8 @@ class StraightRoad(Region):
         return adjusted_delta_y / ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
 
     def __contains__(self, pos: np.ndarray):
+        if self.vcity is not None and self.vcity.raster is not None:
+            return self.vcity.raster.contains_one(self.index, pos)
         if not self.distance_from_axis(pos) < self.width:
             return False
         port1, port2 = [protocol.pos for protocol in self.protocols]
@@ -175,6 +253,22 @@ class StraightRoad(Region):
             return False
         return True
 
+    def contains_many(self, pos: np.ndarray) -> np.ndarray:
+        (x1, y1), (x2, y2) = port1, port2 = [protocol.pos for protocol in self.protocols]
+        x, y = pos[:, 0], pos[:, 1]
+        distance = np.abs((y1 - y) * (x2 - x1) + (x - x1) * (y2 - y1)) / ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
+        squared_length = norm(port1 - port2) ** 2
+        squared1 = ((pos - port1) ** 2).sum(axis=1)
+        squared2 = ((pos - port2) ** 2).sum(axis=1)
+        return (distance < self.width) \
+            & (squared1 <= squared2 + squared_length) & (squared2 <= squared1 + squared_length)
+
+    def nearest_many(self, pos: np.ndarray) -> np.ndarray:
+        """the closest points of the axis"""
+        port1, port2 = [np.asarray(protocol.pos, dtype=float) for protocol in self.protocols]
+        share = np.clip((pos - port1) @ (port2 - port1) / ((port2 - port1) ** 2).sum(), 0, 1)
+        return port1 + share[:, None] * (port2 - port1)
+
 
 class RBuilding(Building):
     def default_attractiveness(self, current_time):
@@ -195,80 +289,82 @@ class TBuilding(Building):
         super().__init__(name, size, loc, 'T', vcity, attract_func)
 
 
-class Individual:
-    index = 0
+class _StoreReference:
+    """Maps an index column of the population store to the Region/Protocol objects of the city"""
+    def __init__(self, column: str, table: str = 'region_table'):
+        self.column = column
+        self.table = table
 
-    def __init__(self, home: RBuilding, crowd: 'Crowd', infected=False):
-        if infected:
-            self.infected_state = INFECTED
-        else:
-            self.infected_state = NORMAL
-
-        self.index = Individual.index
-        Individual.index += 1
-
-        self.home = home
-        self.pos = home.rand_location()
-        self.imagined_current_region: Region = home  # the quasi-current-location that instructs the individual to move
-        self.current_region = home
-        home.add_individual(self)
-
-        self.crowd = crowd
-        self.target = None
-        self.target_protocol = None  # temperate protocol
-
-    def generate_target(self):
-        # noinspection PyTypeChecker
-        candidates: list[Building] = [building for building in self.crowd.non_residential_buildings] + [self.home]
-        weights = [candidate.attractiveness for candidate in candidates]
-        while (res := random.choices(candidates, weights=weights)[0]) == self.current_region:
-            pass
-        return res
+    def __get__(self, indiv: 'Individual', owner=None):
+        if indiv is None:
+            return self
+        index = getattr(indiv.crowd.store, self.column)[indiv.index]
+        return None if index == NO_REGION else getattr(indiv.crowd.vcity, self.table)[index]
 
-    def drift(self):
-        self.pos += np.array([self.crowd.random_nums[self.index], self.crowd.random_nums[-self.index]])
-        ''' if isinstance(self.current_region, Building):
-            while self.pos not in self.current_region and self.pos not in self.imagined_current_region:
-                # noinspection PyUnresolvedReferences
-                self.pos += (self.current_region.cntr - self.pos) / 10'''
-        if self.target is None:
-            self.pos += (self.current_region.cntr - self.pos) / (self.current_region.size / 2)
-            '''while self.pos not in self.current_region:
-                self.pos += (self.current_region.cntr - self.pos) / (self.current_region.size / 10)'''
-
-    def move(self):
-        if self.target is None:
-            while self.pos not in self.current_region:
-                self.pos += (self.current_region.cntr - self.pos) / (self.current_region.size / 10)
-            self.target = self.generate_target()
-            self.target_protocol = self.current_region.find_protocol(self.target)
-            self.imagined_current_region = self.target_protocol.other_side(self.current_region)
+    def __set__(self, indiv: 'Individual', value):
+        getattr(indiv.crowd.store, self.column)[indiv.index] = NO_REGION if value is None else value.index
 
-        # move
-        if self.pos not in self.imagined_current_region:
-            direction = unit_vector(self.target_protocol.pos - self.pos)
-            self.pos += np.round_(direction * self.crowd.step_length, decimals=0)
-
-        if self.pos in self.target:
-            assert self.imagined_current_region == self.target, (f'Current:{self.current_region}',
-                                                                 f'Imagined:{self.imagined_current_region}',
-                                                                 f'Target:{self.target}',
-                                                                 f'Target protocol: {self.target_protocol}',
-                                                                 f'Pos:{self.pos}')
-            self.current_region.remove_individual(self)
-            self.imagined_current_region.add_individual(self)
-            self.current_region = self.imagined_current_region
-            self.target = None
-            return 'arrived'
 
-        if self.pos in self.imagined_current_region:
-            self.current_region.remove_individual(self)
-            self.imagined_current_region.add_individual(self)
-            self.current_region = self.imagined_current_region
+class Individual:
+    """A lightweight view over one row of the crowd's population store"""
+    __slots__ = ('crowd', 'index')
+
+    @classmethod
+    def over(cls, crowd: 'Crowd', index: int) -> 'Individual':
+        """the view over an already filled row of the store"""
+        view = object.__new__(cls)
+        view.crowd = crowd
+        view.index = index
+        return view
 
+    @property
+    def pos(self) -> np.ndarray:
+        return self.crowd.store.pos[self.index]
+
+    @pos.setter
+    def pos(self, value):
+        self.crowd.store.pos[self.index] = value
+
+    @property
+    def infected_state(self):
+        return INFECTED if self.crowd.store.infected[self.index] else NORMAL
+
+    @infected_state.setter
+    def infected_state(self, value):
+        self.crowd.store.infected[self.index] = value == INFECTED
+
+    home = _StoreReference('home')
+    current_region = _StoreReference('current')
+    imagined_current_region = _StoreReference('imagined')
+    target = _StoreReference('target')
+    target_protocol = _StoreReference('target_protocol', 'protocol_table')
+
+    def infect(self):
+        self.current_region.remove_individual(self)
+        self.crowd.normal_individuals.remove(self)
+        self.infected_state = INFECTED
+        self.current_region.add_individual(self)
+        self.crowd.infected_individuals.add(self)
+        self.crowd.new_infected.append(self.index)
+
+    def arrive(self):
+        assert self.imagined_current_region == self.target, (f'Current:{self.current_region}',
+                                                             f'Imagined:{self.imagined_current_region}',
+                                                             f'Target:{self.target}',
+                                                             f'Target protocol: {self.target_protocol}',
+                                                             f'Pos:{self.pos}')
+        self.cross()
+
+    def cross(self):
+        self.current_region.remove_individual(self)
+        self.imagined_current_region.add_individual(self)
+        self.current_region = self.imagined_current_region
+        if self.current_region == self.target:
+            self.target = None
+            self.target_protocol = None
+        else:
             self.target_protocol = self.current_region.find_protocol(self.target)
             self.imagined_current_region = self.target_protocol.other_side(self.current_region)
-            # print('Current target:', self.target_protocol.pos)
 
 
 class VirtualCity:
@@ -277,16 +373,41 @@ class VirtualCity:
         self.residential_buildings: list[RBuilding] = []
         self.non_residential_buildings: list[TBuilding] = []
         self.roads: list[StraightRoad] = []
+        # index tables and per-region arrays used by the vectorized population engine
+        self.region_table: list[Region] = []
+        self.protocol_table: list[Protocol] = []
+        self.region_cntr = np.zeros((0, 2))
+        self.region_size = np.zeros(0)
+        self.protocol_pos = np.zeros((0, 2))
+        self.routing: RoutingTable | None = None
+        self._region_lists: tuple[tuple, list[Building], list[Region]] = ((), [], [])  # cache of buildings/regions
+        self.raster_cell = 1  # cell size of the region raster, None to test membership geometrically
+        self.raster: RegionRaster | None = None
+
+    def register_region(self, region: Region) -> int:
+        self.region_table.append(region)
+        return len(self.region_table) - 1
+
+    def register_protocol(self, protocol: Protocol) -> int:
+        self.protocol_table.append(protocol)
+        return len(self.protocol_table) - 1
+
+    def _lists(self) -> tuple[tuple, list[Building], list[Region]]:
+        """the concatenated lists, rebuilt only after a region was added; callers must not modify them"""
+        key = (len(self.non_residential_buildings), len(self.residential_buildings), len(self.roads))
+        if self._region_lists[0] != key:
+            # noinspection PyTypeChecker
+            buildings: list[Building] = self.non_residential_buildings + self.residential_buildings
+            self._region_lists = (key, buildings, buildings + self.roads)
+        return self._region_lists
 
     @property
     def buildings(self) -> list[Building]:
-        # noinspection PyTypeChecker
-        return self.non_residential_buildings + self.residential_buildings
+        return self._lists()[1]
 
     @property
     def regions(self) -> list[Region]:
-        # noinspection PyTypeChecker
-        return self.buildings + self.roads
+        return self._lists()[2]
 
     def build_road(self, port_dict: dict[Building, tuple[int, int]], width):
         for region, pos in port_dict.items():
@@ -308,57 +429,332 @@ class VirtualCity:
         return res
 
     def finish_construction(self):
+        self.routing = RoutingTable.compile(self)
         for region in self.regions:
             region.finish_construction()
+        self.compile_arrays()
+
+    def topology(self) -> dict[str, np.ndarray]:
+        """
+        the compiled city as flat arrays in region/protocol index order, with the raster if there is one
+        (attract_func is not included)
+        """
+        regions = self.region_table
+        raster = {}
+        if self.raster is not None:
+            raster = {'raster_cell': np.array(self.raster.cell_size),
+                      **{f'raster_{name}': array for name, array in self.raster.arrays().items()}}
+        return {
+            'city_size': np.array(self.size),
+            'region_name': np.array([region.na for region in regions]),
+            'region_type': np.array([region.r_type if isinstance(region, Building) else 'road' for region in regions]),
+            'region_loc': np.array([getattr(region, 'loc', (0, 0)) for region in regions]).reshape(-1, 2),
+            'region_size': np.array([getattr(region, 'size', 0) for region in regions]),
+            'region_width': np.array([getattr(region, 'width', 0) for region in regions]),
+            'protocol_regions': np.array([(protocol.region1.index, protocol.region2.index)
+                                          for protocol in self.protocol_table], dtype=np.int32).reshape(-1, 2),
+            'protocol_pos': np.array([protocol.pos for protocol in self.protocol_table], dtype=float).reshape(-1, 2),
+            **{f'routing_{name}': array for name, array in self.routing.arrays().items()},
+            **raster,
+        }
+
+    def load_topology(self, topology):
+        """rebuild an empty city from topology() without searching routes again"""
+        assert not self.region_table, 'the city is not empty'
+        for name, r_type, loc, size, width in zip(*(topology[column].tolist() for column in (
+                'region_name', 'region_type', 'region_loc', 'region_size', 'region_width'))):
+            if r_type == 'road':
+                self.roads.append(road := StraightRoad(width, self, '', ''))
+                road.na = name
+            else:
+                self.add_region(name, tuple(loc), size, r_type)
+        for (region1, region2), pos in zip(topology['protocol_regions'], topology['protocol_pos']):
+            Region.connect(self.region_table[region1], self.region_table[region2], pos)
+        self.routing = RoutingTable.compile(self, **{name: topology[f'routing_{name}']
+                                                     for name in ('distance', 'next_protocol')})
+        for region in self.regions:
+            region.finish_construction()
+        cached = 'raster_cells' in topology and self.raster_cell == float(topology['raster_cell'])
+        self.compile_arrays({name: topology[f'raster_{name}'] for name in ('cells', 'full_keys', 'partial_keys',
+                                                                            'class_count')} if cached else None)
+
+    def compile_arrays(self, raster_arrays: dict = None):
+        """the per-region arrays and the raster, the latter from raster_arrays (see RegionRaster.arrays) if given"""
+        self.region_cntr = np.array([getattr(region, 'cntr', (np.nan, np.nan)) for region in self.region_table],
+                                    dtype=float).reshape(-1, 2)
+        self.region_size = np.array([getattr(region, 'size', np.nan) for region in self.region_table], dtype=float)
+        self.protocol_pos = np.array([protocol.pos for protocol in self.protocol_table], dtype=float).reshape(-1, 2)
+        self.raster = RegionRaster(self, self.raster_cell, raster_arrays) if self.raster_cell else None
+
+    def outside_all(self, pos: np.ndarray) -> np.ndarray:
+        """mask of the positions that lie in no region at all"""
+        if self.raster is not None:
+            return self.raster.outside_all(pos)
+        return ~np.logical_or.reduce([region.contains_many(pos) for region in self.region_table]
+                                     + [np.zeros(len(pos), dtype=bool)])
+
+    def contains(self, region_indices: np.ndarray, pos: np.ndarray) -> np.ndarray:
+        """batched membership test of pos[i] in region_table[region_indices[i]]"""
+        if self.raster is not None:
+            return self.raster.contains(region_indices, pos)
+        res = np.zeros(len(pos), dtype=bool)
+        for region_index in np.unique(region_indices):
+            mask = region_indices == region_index
+            res[mask] = self.region_table[region_index].contains_many(pos[mask])
+        return res
 
 
 class Crowd:
-    def __init__(self, population: int, initial_infected: int, step_length, drift_sigma, transport_activity):
+    def __init__(self, population: int, initial_infected: int, step_length, drift_sigma, transport_activity,
+                 seed: int | None = None):
         self.initial_infected = initial_infected
         self.population = population
         self.step_length = step_length
         self.drift_sigma = drift_sigma
         self.transport_activity = transport_activity
 
+        self.vcity: VirtualCity | None = None
         self.residential_buildings = []
         self.non_residential_buildings = []
-        self.normal_individuals: list[Individual] = []
-        self.infected_individuals: list[Individual] = []
-        self.transporting_individuals: list[Individual] = []
+        self.store = Population(population)
+        self.views: list[Individual] = []  # views[i] is the Individual over row i of the store
+        self.normal_individuals = MemberSet()
+        self.infected_individuals = MemberSet()
+        self.new_infected: list[int] = []  # indices of the individuals infected in the current tick
+        self.profiler: 'PhaseProfiler | None' = None  # phase timers and counters, None to disable
+        self.event_log: 'EventLog | None' = None  # who infected whom, None to disable
+        self.transit: 'TransitScheduler | None' = None  # event-scheduled trips, None to step every traveller
+        self.streams = RandomStreams(seed)
+        # destination sampling tables, see compile_target_table()
+        self.region_attractiveness: np.ndarray | None = None
+        self.target_regions = np.zeros(0, dtype=np.int64)
+        self.target_bounds = np.zeros(1)
 
-        self.random_nums = []
-        for _ in range(2 * population):
-            random.seed(time.perf_counter())
-            self.random_nums.append(random.gauss(0, 3))
+    @property
+    def individuals(self) -> list[Individual]:
+        return self.views
 
     @property
-    def individuals(self):
-        return self.normal_individuals + self.infected_individuals
+    def transporting_individuals(self) -> list[Individual]:
+        return [self.views[i] for i in np.flatnonzero(self.store.transporting[:self.store.count])]
 
     def initiate_individuals(self, residential_buildings, non_residential_buildings):
         self.residential_buildings = residential_buildings
         self.non_residential_buildings = non_residential_buildings
-        for _ in range(self.population - self.initial_infected):
-            self.normal_individuals.append(Individual(random.choice(self.residential_buildings), self))
-        for _ in range(self.initial_infected):
-            self.infected_individuals.append(Individual(random.choice(self.residential_buildings), self, True))
+        self.vcity = residential_buildings[0].vcity
+        # the store is filled directly, in bulk; the last initial_infected individuals are the infected ones
+        rng = self.streams.placement
+        homes = rng.integers(len(self.residential_buildings), size=self.population)
+        loc = np.array([building.loc for building in self.residential_buildings], dtype=float)[homes]
+        size = np.array([building.size for building in self.residential_buildings], dtype=float)[homes]
+        index = np.array([building.index for building in self.residential_buildings], dtype=np.int32)[homes]
+        self.store.extend(index, Building.rand_locations(loc, size, rng),
+                          np.arange(self.population) >= self.population - self.initial_infected)
+        self.restore_individuals()
+
+    def restore_individuals(self):
+        """rebuild the Individual views and membership lists from an already filled population store"""
+        self.vcity = self.residential_buildings[0].vcity
+        self.views = [Individual.over(self, i) for i in range(self.store.count)]
+        self.rebuild_membership()
+
+    def rebuild_membership(self):
+        """refill the membership sets from the store, after it was changed without going through the views"""
+        for group in [self.normal_individuals, self.infected_individuals] \
+                + [region.normal_individuals for region in self.vcity.regions] \
+                + [region.infected_individuals for region in self.vcity.regions]:
+            group.clear()
+        store, views = self.store, self.views
+        infected = store.infected[:store.count]
+        # group by (region, state) in index order, which is the order the views used to be added in
+        keys = store.current[:store.count].astype(np.int64) * 2 + infected
+        order = np.argsort(keys, kind='stable')
+        starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+        for start, stop in zip(starts.tolist(), np.append(starts[1:], len(order)).tolist()):
+            key = int(keys[order[start]])
+            region = self.vcity.region_table[key // 2]
+            group = region.infected_individuals if key % 2 else region.normal_individuals
+            members = order[start:stop].tolist()
+            group.extend(members, [views[i] for i in members])
+        for group, members in [(self.normal_individuals, np.flatnonzero(~infected).tolist()),
+                               (self.infected_individuals, np.flatnonzero(infected).tolist())]:
+            group.extend(members, [views[i] for i in members])
+
+    def compile_target_table(self, attractiveness: np.ndarray = None):
+        """
+        The attractiveness of every region (given, or read from the buildings) and the cumulative attractiveness of
+        the non-residential buildings: target_regions[j] is drawn for a uniform number in
+        [target_bounds[j], target_bounds[j + 1]). Compiled again whenever the attractiveness changes.
+        """
+        self.region_attractiveness = attractiveness if attractiveness is not None else np.array(
+            [getattr(region, 'attractiveness', 0) for region in self.vcity.region_table], dtype=float)
+        self.target_regions = np.array([building.index for building in self.non_residential_buildings],
+                                       dtype=np.int64)
+        self.target_bounds = np.concatenate([[0.], np.cumsum(self.region_attractiveness[self.target_regions])])
+
+    def generate_targets(self, individuals: np.ndarray) -> np.ndarray:
+        """
+        The next target of every individual with one uniform draw each: the home and the non-residential buildings
+        weighted by attractiveness, without the current region. Instead of drawing again when the current
+        region comes up, its interval is cut out of the cumulative table.
+        """
+        if self.region_attractiveness is None:
+            self.compile_target_table()
+        store = self.store
+        home, current = store.home[individuals], store.current[individuals]
+        attractiveness, bounds = self.region_attractiveness, self.target_bounds
+        home_weight = np.where(current == home, 0., attractiveness[home])
+        slot = np.full(len(self.vcity.region_table), len(self.target_regions), dtype=np.int64)
+        slot[self.target_regions] = np.arange(len(self.target_regions))
+        slot = slot[current]
+        cut_start = np.append(bounds[:-1], np.inf)[slot]  # individuals outside every candidate cut nothing
+        cut_width = np.append(bounds[1:] - bounds[:-1], 0.)[slot]
+        total = bounds[-1] - cut_width + home_weight
+        assert (total > 0).all(), 'no region to go to'
+        draw = self.streams.targets.random(len(individuals)) * total - home_weight
+        draw = np.where(draw >= cut_start, draw + cut_width, draw)
+        chosen = np.append(self.target_regions, NO_REGION)[np.searchsorted(bounds, draw, side='right') - 1]
+        return np.where(draw < 0, home, chosen)
+
+    def depart_all(self, individuals: np.ndarray):
+        """set the target, first protocol and imagined region of every departing individual"""
+        store = self.store
+        current = store.current[individuals]
+        target = self.generate_targets(individuals)
+        routing = self.vcity.routing
+        protocol = routing.next_protocol[current, routing.dest_column[target]]
+        assert (protocol != UNREACHABLE).all(), 'target not accessible'
+        ends = routing.protocol_ends[protocol]
+        store.target[individuals] = target
+        store.target_protocol[individuals] = protocol
+        store.imagined[individuals] = np.where(ends[:, 0] == current, ends[:, 1], ends[:, 0])
+
+    def drift_all(self):
+        store = self.store
+        store.pos[:store.count] += self.streams.drift_block(store.count, self.drift_sigma)
+        settled = np.flatnonzero(store.settled)
+        current = store.current[settled]
+        store.pos[settled] += (self.vcity.region_cntr[current] - store.pos[settled]) \
+            / (self.vcity.region_size[current, None] / 2)
+        self.confine_settled()
+
+    def confine_settled(self, individuals: np.ndarray = None):
+        """put settled individuals (of `individuals`, default all) that drifted out of their building at its edge"""
+        store = self.store
+        settled = np.flatnonzero(store.settled) if individuals is None \
+            else individuals[store.target[individuals] == NO_REGION]
+        escaped = settled[~self.vcity.contains(store.current[settled], store.pos[settled])]
+        current = store.current[escaped]
+        half = (self.vcity.region_size[current, None] - 1) / 2  # Building.nearest_many for every building at once
+        store.pos[escaped] = np.clip(store.pos[escaped], self.vcity.region_cntr[current] - half,
+                                     self.vcity.region_cntr[current] + half)
+
+    def confine_travellers(self, individuals: np.ndarray):
+        """put travellers (of `individuals`) that stepped or drifted off every region back into their current one"""
+        store = self.store
+        strays = individuals[self.vcity.outside_all(store.pos[individuals])]
+        current = store.current[strays]
+        for region in np.unique(current):
+            members = strays[current == region]
+            store.pos[members] = self.vcity.region_table[region].nearest_many(store.pos[members])
+
+    def _leap_terms(self, steps: int):
+        """
+        Per axis the offset y of a settled individual from its region's centre evolves as y' = b (y + noise) with
+        b = 1 - 2 / size, so after k drift_all() calls it is b^k y plus a normal of variance sigma^2 (b^2 + ... + b^2k).
+        :return: the centre, b^k and that standard deviation of every individual
+        """
+        store = self.store
+        current = store.current[:store.count]
+        b = 1 - 2 / self.vcity.region_size[current, None]
+        sd = self.drift_sigma * np.sqrt(b ** 2 * (1 - b ** (2 * steps)) / (1 - b ** 2))
+        return self.vcity.region_cntr[current], b ** steps, sd
+
+    def drift_leap(self, steps: int):
+        """`steps` drift_all() calls of a crowd without travellers, drawn at once"""
+        store = self.store
+        cntr, contraction, sd = self._leap_terms(steps)
+        store.pos[:store.count] = cntr + contraction * (store.pos[:store.count] - cntr) \
+            + sd * self.streams.drift_block(store.count, 1)
+        self.confine_settled()
+
+    def reach(self, steps: int) -> float:
+        """how far any settled individual may get from its position within `steps` drift steps (LEAP_MARGIN sigmas)"""
+        cntr, contraction, sd = self._leap_terms(steps)
+        offset = self.store.pos[:self.store.count] - cntr
+        pull = np.hypot(offset[:, 0], offset[:, 1]) * (1 - contraction[:, 0])
+        return float((pull + LEAP_MARGIN * np.sqrt(2) * sd[:, 0]).max(initial=0))
 
     def move_all(self, current_time):
-        for individual in self.individuals:
-            individual.drift()
+        self.drift_all()
+        if self.profiler is not None:
+            self.profiler.lap('drift')
+        store = self.store
+        transporting = store.transporting[:store.count]
         transport_num = int(self.transport_activity(current_time) * self.population)
-        self.transporting_individuals.extend(
-            random.choices(self.individuals, k=transport_num - len(self.transporting_individuals))
-        )
-        for i, individual in enumerate(self.transporting_individuals):
-            if individual.move() == 'arrived':
-                self.transporting_individuals.pop(i)
+        idle = np.flatnonzero(~transporting)
+        new_num = min(transport_num - (store.count - len(idle)), len(idle))
+        if new_num > 0:
+            transporting[self.streams.targets.choice(idle, new_num, replace=False)] = True
+
+        moving = np.flatnonzero(transporting)
+        departing = moving[store.target[moving] == NO_REGION]
+        self.depart_all(departing)
+        if self.transit is not None:
+            self.transit.depart(departing)
+            arrivals, crossings = self.transit.advance()
+        else:
+            stepping = moving[~self.vcity.contains(store.imagined[moving], store.pos[moving])]
+            direction = unit_vectors(self.vcity.protocol_pos[store.target_protocol[stepping]] - store.pos[stepping])
+            store.pos[stepping] += np.round(direction * self.step_length)
+
+            arrived = self.vcity.contains(store.target[moving], store.pos[moving])
+            for i in moving[arrived]:
+                self.views[i].arrive()
+            transporting[moving[arrived]] = False
+            on_way = moving[~arrived]
+            crossing = on_way[self.vcity.contains(store.imagined[on_way], store.pos[on_way])]
+            for i in crossing:
+                self.views[i].cross()
+            self.confine_travellers(on_way)
+            arrivals, crossings = int(arrived.sum()), len(crossing)
+        if self.profiler is not None:
+            self.profiler.count('moved', len(moving))
+            self.profiler.count('departures', len(departing))
+            self.profiler.count('transitions', arrivals + crossings)
+            self.profiler.count('find_protocol', len(departing) + crossings)
+            self.profiler.lap('move')
+
+    def update_infected(self, virus: 'Virus'):
+        """infection in every region at once, using one cell grid keyed by current region"""
+        self.new_infected = []
+        if virus.brute_force:
+            for region in self.vcity.regions:
+                region.update_infected(virus)
+            return
+        store = self.store
+        infected = store.infected[:store.count]
+        sources, targets = np.flatnonzero(infected), np.flatnonzero(~infected)
+        if len(sources) == 0 or len(targets) == 0:
+            return
+        grid = CellGrid(virus.infection_radius)
+        grid.build(store.pos[targets], store.current[targets])
+        source, close, distance = grid.query(store.pos[sources], store.current[sources], virus.infection_radius)
+        hit, pair = infection_pairs(close, virus.risk, self.streams)
+        for i in targets[hit]:
+            self.views[i].infect()
+        if self.event_log is not None:
+            self.event_log.contacts(sources[source], targets[close], distance)
+            self.event_log.infections(sources[source[pair]], targets[hit], distance[pair])
+        if self.profiler is not None:
+            self.profiler.count('pair_checks', grid.checked)
 
 
 class Virus:
-    def __init__(self, infection_radius, risk):
+    def __init__(self, infection_radius, risk, brute_force=False):
         self.infection_radius = infection_radius
         self.risk = risk
+        self.brute_force = brute_force  # test every infected/normal pair instead of using a cell grid
 
 
 class Simulation(VirtualCity, Crowd, Virus):
@@ -372,34 +768,193 @@ class Simulation(VirtualCity, Crowd, Virus):
                  transport_activity,     # percent of population transporting among regions in a given time unit (func)
                  infection_radius: float,
                  risk: float,
+                 brute_force: bool = False,  # reference O(infected x normal) contact detection
+                 seed: int = None,           # seed of the random streams, None for a fresh one
                  ):
         self.current_time = 0
         self.current_day = 0
         self.time_period = time_period
         VirtualCity.__init__(self, size)
-        Crowd.__init__(self, population, initial_infected, step_length, drift_sigma, transport_activity)
-        Virus.__init__(self, infection_radius, risk)
+        Crowd.__init__(self, population, initial_infected, step_length, drift_sigma, transport_activity, seed)
+        Virus.__init__(self, infection_radius, risk, brute_force)
+        self.recorder: 'MetricsRecorder | None' = None  # per-tick metrics, None to disable
+        self.telemetry: 'TelemetryServer | None' = None  # live stream of the run, None to disable
+        self.elapsed_ticks = 0
+        self.fast_forward = False  # leap over quiescent stretches, see quiescent_horizon()
+        self.max_leap = TIME_CONSTANT
+        self._leap_backoff = [0, 1]  # ticks until the next quiescence check, wait after the next failed one
+        self.schedule: AttractivenessSchedule | None = None  # compiled on first use, see compile_schedule()
+        self._schedule_segment = -1
 
     def finish_construction(self):
-        VirtualCity.finish_construction(self)
+        if self.routing is None:  # not compiled (or loaded from a cached city) yet
+            VirtualCity.finish_construction(self)
         self.initiate_individuals(self.residential_buildings, self.non_residential_buildings)
 
-    def progress(self):
-        if self.current_time not in range(*self.time_period):
-            self.current_time = self.time_period[0]
-            self.current_day += 1
+    def clock_after(self, steps: int) -> tuple[int, int]:
+        """(current_time, current_day) after `steps` ticks; a day runs from time_period[0] to time_period[1]"""
+        start, end = self.time_period
+        phase = self.current_time - start if start <= self.current_time <= end else end - start
+        days, phase = divmod(phase + steps, end - start + 1)
+        return start + phase, self.current_day + days
+
+    def advance_clock(self, steps: int = 1):
+        self.current_time, self.current_day = self.clock_after(steps)
+        self.elapsed_ticks += steps
+
+    def quiescent_horizon(self, max_ticks: int) -> int:
+        """
+        The number of upcoming ticks in which nothing but drift can happen: nobody is transporting or starts to, and no
+        infected individual can get within infection_radius of a normal one in the same region (allowing for reach()).
+        """
+        store = self.store
+        if store.transporting[:store.count].any():
+            return 0
+        steps = 0
+        while steps < max_ticks and int(self.transport_activity(self.clock_after(steps + 1)[0]) * self.population) <= 0:
+            steps += 1
+        if steps < 2:
+            return 0
+        infected = store.infected[:store.count]
+        current = store.current[:store.count]
+        mixed = np.intersect1d(current[infected], current[~infected])
+        if len(mixed) == 0:  # infection is region-local, so only drift is left
+            return steps
+        sources = np.flatnonzero(infected & np.isin(current, mixed))
+        targets = np.flatnonzero(~infected & np.isin(current, mixed))
+        # double the leap while pairs stay apart; trying small radii first keeps the grid queries cheap
+        safe = 0
+        for trial in sorted({min(2 ** i, steps) for i in range(1, steps.bit_length() + 1)}):
+            radius = self.infection_radius + 2 * self.reach(trial)
+            grid = CellGrid(radius)
+            grid.build(store.pos[targets], current[targets])
+            if len(grid.query(store.pos[sources], current[sources], radius)[0]):
+                break
+            safe = trial
+        return safe
+
+    def leap(self, steps: int):
+        """advance a quiescent stretch of `steps` ticks at once"""
+        self.advance_clock(steps)
+        self.refresh_attractiveness()
+        self.drift_leap(steps)
+        self.new_infected = []
+
+    def compile_schedule(self):
+        """tabulate the attract_func of every building; call again after replacing one"""
+        self.schedule = AttractivenessSchedule(self.buildings, len(self.region_table), self.time_period)
+        self._schedule_segment = -1
+
+    def refresh_attractiveness(self):
+        """a row lookup in the schedule; the buildings and the target table change only at its change points"""
+        if self.schedule is None:
+            self.compile_schedule()
+        segment = self.schedule.segment(self.current_time)
+        if segment < 0:  # outside time_period, where the schedule has no entry
+            for building in self.buildings:
+                building.update_attractiveness(self.current_time)
+            self.compile_target_table()
+        elif segment != self._schedule_segment:
+            attractiveness = self.schedule.values[segment]
+            for building in self.buildings:
+                building.attractiveness = attractiveness[building.index]
+            self.compile_target_table(attractiveness)
+        self._schedule_segment = segment
+
+    def progress(self) -> int:
+        """advance one tick, or a whole quiescent stretch with fast_forward; returns the number of ticks advanced"""
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_tick()
+        steps = 0
+        if self.fast_forward and self._leap_backoff[0] <= 0:
+            steps = self.quiescent_horizon(self.max_leap)
+            # after a failed check wait 1, 2, 4, ... ticks before checking again
+            self._leap_backoff = [0, 1] if steps > 1 else [self._leap_backoff[1], min(2 * self._leap_backoff[1], 64)]
+        self._leap_backoff[0] -= 1
+        if steps > 1:
+            self.leap(steps)
+            if profiler is not None:
+                profiler.count('leaped', steps)
+                profiler.lap('leap')
         else:
-            self.current_time += 1
-
+            steps = 1
+            self.tick()
+            if profiler is not None:
+                profiler.lap('infection')
+
+        if self.recorder is not None:
+            self.recorder.record(self)
+            if profiler is not None:
+                profiler.lap('record')
+        if self.telemetry is not None:
+            self.telemetry.publish(self)
+            if profiler is not None:
+                profiler.lap('telemetry')
+        if profiler is not None:
+            profiler.end_tick()
+        return steps
+
+    def tick(self):
+        profiler = self.profiler
+        self.advance_clock()
         # update attractiveness
-        for building in self.buildings:
-            building.update_attractiveness(self.current_time)
+        self.refresh_attractiveness()
+        if profiler is not None:
+            profiler.lap('attractiveness')
         # move
         self.move_all(self.current_time)
         # update infection state
-        for region in self.regions:
-            region.update_infected(self)
-
+        self.update_infected(self)
+        if profiler is not None:
+            profiler.count('infections', len(self.new_infected))
+
+    def save_checkpoint(self, path):
+        """
+        Write the whole state (topology with its raster, individuals, clock, parameters, random streams and the
+        transit schedule if there is one) as flat arrays to a compressed .npz file. transport_activity is stored only
+        if it is a ConstantActivity. Recorders, event logs and telemetry are not part of the state.
+        """
+        settings = {'time_period': list(self.time_period), 'population': self.population,
+                    'initial_infected': self.initial_infected, 'step_length': self.step_length,
+                    'drift_sigma': self.drift_sigma, 'infection_radius': self.infection_radius, 'risk': self.risk,
+                    'brute_force': self.brute_force, 'current_time': self.current_time,
+                    'current_day': self.current_day, 'elapsed_ticks': self.elapsed_ticks,
+                    'streams': self.streams.get_state()}
+        if isinstance(self.transport_activity, ConstantActivity):
+            settings['transport_activity'] = self.transport_activity.value
+        arrays = {**self.topology(), **{f'individual_{name}': column for name, column in self.store.state().items()}}
+        if self.transit is not None:
+            arrays.update({f'transit_{name}': array for name, array in self.transit.state().items()})
+        np.savez_compressed(path, settings=np.array(json.dumps(settings)), **arrays)
+
+    @classmethod
+    def load_checkpoint(cls, path, transport_activity=None) -> 'Simulation':
+        """a new simulation continuing from save_checkpoint(); transport_activity is required if it was not stored"""
+        with np.load(path) as checkpoint:
+            settings = json.loads(str(checkpoint['settings']))
+            if transport_activity is None:
+                assert 'transport_activity' in settings, 'transport_activity was not stored in the checkpoint'
+                transport_activity = ConstantActivity(settings['transport_activity'])
+            sim = cls(time_period=tuple(settings['time_period']), size=int(checkpoint['city_size']),
+                      population=settings['population'], initial_infected=settings['initial_infected'],
+                      step_length=settings['step_length'], drift_sigma=settings['drift_sigma'],
+                      transport_activity=transport_activity, infection_radius=settings['infection_radius'],
+                      risk=settings['risk'])
+            sim.brute_force = settings['brute_force']  # set after, subclasses need not take it
+            sim.load_topology(checkpoint)
+            sim.store.load_state({name: checkpoint[f'individual_{name}'] for name in Population.COLUMNS})
+            transit = {name[len('transit_'):]: checkpoint[name] for name in checkpoint.files
+                       if name.startswith('transit_')}
+        sim.restore_individuals()
+        if transit:
+            from Transit import TransitScheduler  # only checkpoints of scheduled transit need it
+            sim.transit = TransitScheduler(sim)
+            sim.transit.load_state(transit)
+        sim.streams.set_state(settings['streams'])
+        sim.current_time, sim.current_day = settings['current_time'], settings['current_day']
+        sim.elapsed_ticks = settings.get('elapsed_ticks', 0)
+        return sim
 
 if __name__ == '__main__':
     class _Test:
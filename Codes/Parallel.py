@@ -0,0 +1,288 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from Objects import Simulation, VirtualCity, TIME_CONSTANT
+from Population import Population, NO_REGION
+from Contact import CellGrid, infection_pairs
+from RandomStreams import RandomStreams
+from Tool import unit_vectors
+
+
+def shared_array(shape: tuple, dtype, name: str = None) -> tuple[shared_memory.SharedMemory, np.ndarray]:
+    """a new (name None) or attached shared memory block and the array over it"""
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=name is None, size=max(int(np.prod(shape)) * dtype.itemsize, 1),
+                                       name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+class SharedPopulation(Population):
+    """A Population whose columns live in shared memory blocks, so that worker processes can attach to them by name"""
+    def __init__(self, capacity: int, names: list[str] = None):
+        defaults = Population(1)
+        self.capacity = capacity
+        self.count = 0
+        self.blocks: list[shared_memory.SharedMemory] = []
+        for i, column in enumerate(self.COLUMNS):
+            default = getattr(defaults, column)
+            block, array = shared_array((capacity,) + default.shape[1:], default.dtype,
+                                        None if names is None else names[i])
+            if names is None:
+                array[:] = default[0]
+            self.blocks.append(block)
+            setattr(self, column, array)
+
+    @property
+    def names(self) -> list[str]:
+        return [block.name for block in self.blocks]
+
+    def close(self, unlink=False):
+        for column in self.COLUMNS:  # the arrays must go before the buffers they view
+            setattr(self, column, None)
+        for block in self.blocks:
+            block.close()
+            if unlink:
+                block.unlink()
+        self.blocks = []
+
+
+def partition_regions(vcity: VirtualCity, parts: int) -> np.ndarray:
+    """
+    The partition of every region. Buildings are split into `parts` equally long runs in (x, y) order, so that
+    partitions are contiguous strips and few protocols cross between them; a road goes with its first building.
+    """
+    owner = np.zeros(len(vcity.region_table), dtype=np.int32)
+    buildings = sorted(vcity.buildings, key=lambda building: (building.loc[0], building.loc[1]))
+    for rank, building in enumerate(buildings):
+        owner[building.index] = rank * parts // len(buildings)
+    for road in vcity.roads:
+        owner[road.index] = owner[road.protocols[0].other_side(road).index]
+    return owner
+
+
+def _cross(sim: Simulation, individuals: np.ndarray):
+    """Individual.cross (and arrive) on the store only; the membership sets are left to rebuild_membership()"""
+    store, routing = sim.store, sim.routing
+    current = store.imagined[individuals]
+    store.current[individuals] = current
+    arrived = current == store.target[individuals]
+    for column in (store.target, store.target_protocol):
+        column[individuals[arrived]] = NO_REGION
+    store.transporting[individuals[arrived]] = False
+    on_way, current = individuals[~arrived], current[~arrived]
+    protocol = routing.next_protocol[current, routing.dest_column[store.target[on_way]]]
+    ends = routing.protocol_ends[protocol]
+    store.target_protocol[on_way] = protocol
+    store.imagined[on_way] = np.where(ends[:, 0] == current, ends[:, 1], ends[:, 0])
+
+
+def _move(sim: Simulation, owned: np.ndarray, new_travellers: int) -> np.ndarray:
+    """Crowd.move_all for the individuals of one partition; returns those that crossed into another region"""
+    store = sim.store
+    store.pos[owned] += sim.streams.drift_block(len(owned), sim.drift_sigma)
+    settled = owned[store.target[owned] == NO_REGION]
+    current = store.current[settled]
+    store.pos[settled] += (sim.region_cntr[current] - store.pos[settled]) / (sim.region_size[current, None] / 2)
+    sim.confine_settled(owned)
+
+    idle = owned[~store.transporting[owned]]
+    if new_travellers > 0:
+        store.transporting[sim.streams.targets.choice(idle, new_travellers, replace=False)] = True
+    moving = owned[store.transporting[owned]]
+    sim.depart_all(moving[store.target[moving] == NO_REGION])
+    stepping = moving[~sim.contains(store.imagined[moving], store.pos[moving])]
+    direction = unit_vectors(sim.protocol_pos[store.target_protocol[stepping]] - store.pos[stepping])
+    store.pos[stepping] += np.round(direction * sim.step_length)
+
+    arrived = sim.contains(store.target[moving], store.pos[moving])
+    on_way = moving[~arrived]
+    crossing = on_way[sim.contains(store.imagined[on_way], store.pos[on_way])]
+    crossed = np.concatenate([moving[arrived], crossing])
+    _cross(sim, crossed)
+    sim.confine_travellers(on_way)
+    return crossed
+
+
+def _infect(sim: Simulation, owned: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Crowd.update_infected for the individuals of one partition; returns the (infectee, infector, distance) events"""
+    store = sim.store
+    infected = store.infected[owned]
+    sources, targets = owned[infected], owned[~infected]
+    if len(sources) == 0 or len(targets) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    grid = CellGrid(sim.infection_radius)
+    grid.build(store.pos[targets], store.current[targets])
+    source, close, distance = grid.query(store.pos[sources], store.current[sources], sim.infection_radius)
+    hit, pair = infection_pairs(close, sim.risk, sim.streams)
+    store.infected[targets[hit]] = True
+    return targets[hit], sources[source[pair]], distance[pair]
+
+
+def _worker(connection, template: Simulation, names: list[str], count: int, owner: np.ndarray, partition: int,
+            seed):
+    """
+    Serve the commands of ParallelSimulation for one partition. The worker keeps the indices of the individuals it
+    owns and updates them from crossings only: after moving it hands over those that crossed into another
+    partition's region, and before infecting it takes in those handed to it.
+    """
+    sim = template
+    sim.vcity = sim.residential_buildings[0].vcity  # as initiate_individuals would
+    sim.store = SharedPopulation(count, names)
+    sim.store.count = count
+    sim.streams = RandomStreams(seed)
+    owned = np.zeros(0, dtype=np.int64)
+    try:
+        while True:
+            command, *args = connection.recv()
+            if command == 'stop':
+                break
+            if command == 'own':
+                owned, = args
+            elif command == 'move':
+                sim.current_time, sim.current_day, new_travellers = args
+                sim.refresh_attractiveness()
+                crossed = _move(sim, owned, new_travellers)
+                destination = owner[sim.store.current[crossed]]
+                leaving = destination != partition
+                owned = owned[~np.isin(owned, crossed[leaving], assume_unique=True)]
+                connection.send((crossed[leaving], destination[leaving]))
+            elif command == 'infect':
+                owned = np.concatenate([owned, args[0]])
+                idle = int(np.count_nonzero(~sim.store.transporting[owned]))
+                connection.send((*_infect(sim, owned), idle))
+    finally:
+        sim.store.close()
+        connection.close()
+
+
+class ParallelSimulation:
+    """
+    One Simulation run on several processes by domain decomposition: the regions are split into partitions
+    (partition_regions) and every worker moves and infects the individuals currently in its own regions.
+    The population store lives in shared memory, so nothing is copied between processes; an individual changes hands
+    by crossing a protocol into another partition's region. A tick is two phases (movement, then infection, as in
+    Simulation.tick) with the workers in lockstep. Between them only the indices of the individuals that changed
+    partition go through the coordinator, and the workers report how many of theirs are idle, so no process scans
+    the whole population in a tick. Scaling with the number of cores has not been measured.
+
+    The coordinator keeps the clock and splits the new travellers of a tick between the partitions with a
+    multivariate hypergeometric draw, which is how serial move_all picks them among all idle individuals.
+    Each worker draws from its own streams, seeded with [seed, partition], so a run is reproducible for a fixed
+    number of workers and matches the serial engine in distribution, not draw by draw.
+    Fast-forward, scheduled transit, the profiler, the brute-force contact path and contact sampling are serial-only;
+    a recorder, telemetry server or event log (of infections) may be attached to sim.
+    The membership sets of sim are not kept up to date while running, call sync() before using them.
+    """
+    def __init__(self, template: Simulation, workers: int, seed: int = 0):
+        if template.routing is None:
+            VirtualCity.finish_construction(template)
+        assert not template.individuals, 'the template must not be populated yet'
+        self.sim = template
+        self.workers = workers
+        self.owner = partition_regions(template, workers)
+        template.compile_schedule()  # once, for all workers
+        self.store = SharedPopulation(template.population)
+        self.migrations = 0  # individuals that moved to another partition so far
+
+        # the workers get the city before it is populated, so that starting them copies little
+        context = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for partition in range(workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(child, template, self.store.names, template.population, self.owner,
+                                            partition, [seed, partition]))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+        template.streams = RandomStreams([seed, workers])  # placement and the split of the travellers
+        template.store = self.store
+        template.initiate_individuals(template.residential_buildings, template.non_residential_buildings)
+        labels = self.owner[self.store.current[:self.store.count]]
+        for partition, connection in enumerate(self.connections):
+            connection.send(('own', np.flatnonzero(labels == partition)))
+        self.idle = np.bincount(labels[~self.store.transporting[:self.store.count]], minlength=workers)
+
+    def _broadcast(self, *messages) -> list:
+        for connection, message in zip(self.connections, messages):
+            connection.send(message)
+        return [connection.recv() for connection in self.connections]
+
+    def progress(self) -> int:
+        sim = self.sim
+        sim.advance_clock()
+        sim.refresh_attractiveness()
+        idle = self.idle
+        transporting = sim.population - int(idle.sum())
+        new_num = min(int(sim.transport_activity(sim.current_time) * sim.population) - transporting, int(idle.sum()))
+        split = sim.streams.targets.multivariate_hypergeometric(idle, new_num) if new_num > 0 else np.zeros_like(idle)
+        handed = self._broadcast(*[('move', sim.current_time, sim.current_day, int(new_travellers))
+                                   for new_travellers in split])
+        leaving, destination = map(np.concatenate, zip(*handed))
+        self.migrations += len(leaving)
+        order = np.argsort(destination, kind='stable')
+        arrivals = np.split(leaving[order], np.searchsorted(destination[order], np.arange(1, self.workers)))
+        infectee, infector, distance, idle = zip(*self._broadcast(*[('infect', arriving) for arriving in arrivals]))
+        infectee, infector, distance = map(np.concatenate, (infectee, infector, distance))
+        self.idle = np.array(idle)
+        sim.new_infected = infectee.tolist()
+        if sim.event_log is not None:
+            sim.event_log.infections(infector, infectee, distance)
+        if sim.recorder is not None:
+            sim.recorder.record(sim)
+        if sim.telemetry is not None:
+            sim.telemetry.publish(sim)
+        return 1
+
+    @property
+    def infected_count(self) -> int:
+        return int(self.store.infected[:self.store.count].sum())
+
+    def sync(self):
+        """bring the Individual membership sets of sim up to date with the store"""
+        self.sim.rebuild_membership()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('stop',))
+        for process in self.processes:
+            process.join()
+        self.sync()
+        # sim keeps a private copy of the population, the shared blocks go away
+        private = Population(self.store.capacity)
+        private.load_state(self.store.state())
+        self.sim.store = private
+        self.store.close(unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    class _Test:
+        import time
+        from Cities import build_test_city
+        from Tool import ConstantActivity
+        for _workers in (0, 2, 4):
+            sim = Simulation(time_period=(6 * TIME_CONSTANT, 20 * TIME_CONSTANT), size=1000, population=3000,
+                             initial_infected=20, step_length=10, drift_sigma=3,
+                             transport_activity=ConstantActivity(0.1), infection_radius=1.8, risk=0.001, seed=0)
+            build_test_city(sim)
+            start = time.perf_counter()
+            if _workers:
+                with ParallelSimulation(sim, _workers) as parallel:
+                    while sim.current_day < 2:
+                        parallel.progress()
+                    print(f'{_workers} workers: {parallel.migrations} migrations', end=', ')
+            else:
+                sim.finish_construction()
+                while sim.current_day < 2:
+                    sim.progress()
+                print('serial', end=', ')
+            print(f'{len(sim.infected_individuals)} infected, {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,83 @@
+import numpy as np
+NO_REGION = -1  # marks an empty region/protocol slot (e.g. no target)
+
+
+class Population:
+    """Structure-of-arrays store of every individual's state, one row per individual"""
+    COLUMNS = ('pos', 'home', 'current', 'imagined', 'target', 'target_protocol', 'infected', 'transporting')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        self.home = np.full(capacity, NO_REGION, dtype=np.int32)
+        self.current = np.full(capacity, NO_REGION, dtype=np.int32)
+        self.imagined = np.full(capacity, NO_REGION, dtype=np.int32)
+        self.target = np.full(capacity, NO_REGION, dtype=np.int32)
+        self.target_protocol = np.full(capacity, NO_REGION, dtype=np.int32)
+        self.infected = np.zeros(capacity, dtype=bool)
+        self.transporting = np.zeros(capacity, dtype=bool)
+
+    def extend(self, home: np.ndarray, pos: np.ndarray, infected: np.ndarray) -> np.ndarray:
+        """append rows for individuals staying at home; returns their indices"""
+        count = len(home)
+        assert self.count + count <= self.capacity, 'population store is full'
+        rows = slice(self.count, self.count + count)
+        self.pos[rows] = pos
+        self.home[rows] = self.current[rows] = self.imagined[rows] = home
+        self.infected[rows] = infected
+        self.count += count
+        return np.arange(rows.start, rows.stop)
+
+    @property
+    def settled(self) -> np.ndarray:
+        """mask of individuals staying in a building (no target)"""
+        return self.target[:self.count] == NO_REGION
+
+    def state(self) -> dict[str, np.ndarray]:
+        """the filled rows of every column"""
+        return {column: getattr(self, column)[:self.count] for column in self.COLUMNS}
+
+    def load_state(self, state: dict[str, np.ndarray]):
+        count = len(state['pos'])
+        assert count <= self.capacity, 'population store is too small'
+        for column in self.COLUMNS:
+            getattr(self, column)[:count] = state[column]
+        self.count = count
+
+
+class MemberSet:
+    """
+    Individuals of one group (a region's normal or infected individuals, or those of the whole crowd) keyed by their
+    store index, so that add/remove are O(1). Iterates in insertion order, as the lists it replaces did.
+    """
+    def __init__(self, members=()):
+        self._members = {member.index: member for member in members}
+
+    def add(self, member):
+        self._members[member.index] = member
+
+    def remove(self, member):
+        del self._members[member.index]
+
+    def clear(self):
+        self._members.clear()
+
+    def extend(self, indices, members):
+        """add many members at once, given with their store indices"""
+        self._members.update(zip(indices, members))
+
+    def indices(self) -> np.ndarray:
+        return np.fromiter(self._members, dtype=np.int64, count=len(self._members))
+
+    def __contains__(self, member):
+        return member.index in self._members
+
+    def __iter__(self):
+        return iter(self._members.values())
+
+    def __len__(self):
+        return len(self._members)
+
+    def __repr__(self):
+        return f'MemberSet({list(self._members)})'
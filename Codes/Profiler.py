@@ -0,0 +1,62 @@
+import time
+from collections import defaultdict
+PHASES = ('attractiveness', 'drift', 'move', 'infection', 'leap', 'record', 'telemetry')
+COUNTERS = ('moved', 'departures', 'transitions', 'find_protocol', 'pair_checks', 'infections', 'leaped')
+
+
+class PhaseProfiler:
+    """
+    Opt-in phase timers and counters of Simulation.progress. Attach with Simulation.profiler = PhaseProfiler();
+    the hooks in the engine are a single `is not None` check each while it is detached.
+    Each phase is timed by lap(): the time since the previous lap (or the start of the tick) goes to that phase.
+    """
+    def __init__(self, summary_every: int = 0, report=print):
+        self.summary_every = summary_every  # ticks between printed summaries, 0 for none
+        self.report = report
+        self.ticks = 0
+        self.totals: dict[str, float] = defaultdict(float)
+        self.counters: dict[str, int] = defaultdict(int)
+        self.last_tick: dict[str, float] = {}
+        self._current: dict[str, float] = defaultdict(float)
+        self._mark = 0.
+
+    def begin_tick(self):
+        self._current = defaultdict(float)
+        self._mark = time.perf_counter()
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self._current[phase] += now - self._mark
+        self._mark = now
+
+    def count(self, counter: str, amount: int = 1):
+        self._current[counter] += amount
+
+    def end_tick(self):
+        for name, value in self._current.items():
+            if name in COUNTERS:
+                self.counters[name] += int(value)
+            else:
+                self.totals[name] += value
+        self.last_tick = dict(self._current)
+        self.ticks += 1
+        if self.summary_every and self.ticks % self.summary_every == 0:
+            self.report(self.summary())
+
+    def mean(self) -> dict[str, float]:
+        """mean seconds per tick of every phase and mean count per tick of every counter"""
+        res = {phase: total / max(self.ticks, 1) for phase, total in self.totals.items()}
+        res.update({counter: total / max(self.ticks, 1) for counter, total in self.counters.items()})
+        return res
+
+    def summary(self) -> str:
+        tick_time = sum(self.totals.values())
+        lines = [f'{self.ticks} ticks, {tick_time / max(self.ticks, 1) * 1000:.3f}ms per tick']
+        for phase in PHASES:
+            if phase in self.totals:
+                lines.append(f'  {phase:>14}: {self.totals[phase] / max(self.ticks, 1) * 1000:9.3f}ms '
+                             f'({self.totals[phase] / max(tick_time, 1e-12):6.1%})')
+        for counter in COUNTERS:
+            if counter in self.counters:
+                lines.append(f'  {counter:>14}: {self.counters[counter] / max(self.ticks, 1):9.1f} per tick')
+        return '\n'.join(lines)
@@ -0,0 +1,29 @@
+import numpy as np
+STREAM_NAMES = ('drift', 'targets', 'infection', 'placement')
+
+
+class RandomStreams:
+    """
+    The single source of randomness of a simulation: one seedable numpy Generator per subsystem, spawned from one
+    SeedSequence so that the streams are independent and a run is reproducible from its seed.
+    """
+    def __init__(self, seed: int | None = None):
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.seed = self.seed_sequence.entropy
+        generators = [np.random.default_rng(child) for child in self.seed_sequence.spawn(len(STREAM_NAMES))]
+        self.drift, self.targets, self.infection, self.placement = generators
+
+    def drift_block(self, count: int, sigma: float) -> np.ndarray:
+        """the (count, 2) drift displacements of one tick"""
+        return self.drift.normal(0, sigma, (count, 2))
+
+    def infection_block(self, count: int) -> np.ndarray:
+        """one uniform per contact pair of one tick"""
+        return self.infection.random(count)
+
+    def get_state(self) -> dict[str, dict]:
+        return {name: getattr(self, name).bit_generator.state for name in STREAM_NAMES}
+
+    def set_state(self, state: dict[str, dict]):
+        for name in STREAM_NAMES:
+            getattr(self, name).bit_generator.state = state[name]
@@ -0,0 +1,187 @@
+import numpy as np
+EMPTY = 0  # class of the cells no region touches (and of everything off the map)
+FULL, PARTIAL = 1, 2  # how a class covers a region, in RegionRaster.coverage
+DENSE_LIMIT = 1 << 25  # largest class x region table of coverage kept dense; beyond, the sorted keys are searched
+_HALF_DIAGONAL = 2 ** 0.5 / 2
+
+
+class RegionRaster:
+    """
+    The city rasterized once into square cells. Every cell holds a class id, and every class is the set of regions
+    covering the whole cell (full) plus the set of regions covering only part of it (partial). Membership of a
+    position is then an array lookup; only positions in partial cells fall back to the geometric test, and so do
+    positions off the raster, which covers [0, extent) with extent the far corner of the city or of its regions,
+    whichever is larger. Buildings with integer loc/size are never partial at cell_size 1.
+    """
+    def __init__(self, vcity, cell_size: float = 1, arrays: dict = None):
+        """arrays: those of arrays() for the same city and cell_size, to skip rasterizing"""
+        self.vcity = vcity
+        self.cell_size = cell_size
+        region_count = len(vcity.region_table)
+        if arrays is not None:
+            self.cells = np.asarray(arrays['cells'])
+            self.shape = self.cells.shape
+            self.full_keys = np.asarray(arrays['full_keys'], dtype=np.int64)
+            self.partial_keys = np.asarray(arrays['partial_keys'], dtype=np.int64)
+            members = [[set(), set()] for _ in range(int(arrays['class_count']))]
+            for side, keys in enumerate((self.full_keys, self.partial_keys)):
+                for cls, region in zip((keys // region_count).tolist(), (keys % region_count).tolist()):
+                    members[cls][side].add(region)
+            self.classes = [(frozenset(full), frozenset(partial)) for full, partial in members]
+            self._compile_coverage()
+            return
+
+        self.classes: list[tuple[frozenset, frozenset]] = [(frozenset(), frozenset())]
+        self._class_ids = {self.classes[0]: EMPTY}
+        self.shape = tuple(np.ceil(self._extent(vcity) / cell_size).astype(int).tolist())
+        self.cells = np.zeros(self.shape, dtype=np.uint16)  # widened by _class_of if there are ever more classes
+        for region in vcity.region_table:
+            full, partial = self._coverage(region)
+            self._paint(region.index, full, partial)
+        self.full_keys = np.sort(np.array([cls * region_count + region for cls, (full, _) in enumerate(self.classes)
+                                           for region in full], dtype=np.int64))
+        self.partial_keys = np.sort(np.array([cls * region_count + region
+                                              for cls, (_, partial) in enumerate(self.classes)
+                                              for region in partial], dtype=np.int64))
+        self._compile_coverage()
+
+    def _compile_coverage(self):
+        """coverage[class * region_count + region]: EMPTY, FULL or PARTIAL; None if too large, see DENSE_LIMIT"""
+        size = len(self.classes) * len(self.vcity.region_table)
+        self.coverage = None
+        if size <= DENSE_LIMIT:
+            self.coverage = np.full(size, EMPTY, dtype=np.uint8)
+            self.coverage[self.full_keys] = FULL
+            self.coverage[self.partial_keys] = PARTIAL
+
+    def coverage_of(self, keys: np.ndarray) -> np.ndarray:
+        """the coverage of every class * region_count + region key"""
+        if self.coverage is not None:
+            return self.coverage[keys]
+        res = np.full(len(keys), EMPTY, dtype=np.uint8)
+        for kind, table in ((FULL, self.full_keys), (PARTIAL, self.partial_keys)):
+            found = np.minimum(np.searchsorted(table, keys), len(table) - 1)
+            if len(table):
+                res[table[found] == keys] = kind
+        return res
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """the raster as flat arrays, to be passed back to the constructor"""
+        return {'cells': self.cells, 'full_keys': self.full_keys, 'partial_keys': self.partial_keys,
+                'class_count': np.array(len(self.classes))}
+
+    @staticmethod
+    def _extent(vcity) -> np.ndarray:
+        """per axis the far edge of the city or of any region in it"""
+        corners = [np.full(2, float(vcity.size))]
+        for region in vcity.region_table:
+            if hasattr(region, 'loc'):
+                corners.append(np.asarray(region.loc, dtype=float) + region.size)
+            else:
+                corners += [np.asarray(protocol.pos, dtype=float) + region.width + 1 for protocol in region.protocols]
+        return np.max(corners, axis=0)
+
+    def _class_of(self, full: frozenset, partial: frozenset) -> int:
+        key = (full, partial)
+        if key not in self._class_ids:
+            self._class_ids[key] = len(self.classes)
+            self.classes.append(key)
+            if len(self.classes) > np.iinfo(self.cells.dtype).max + 1:
+                self.cells = self.cells.astype(np.uint32)
+        return self._class_ids[key]
+
+    def _paint(self, region: int, full: tuple, partial: tuple):
+        for cells, is_full in ((full, True), (partial, False)):
+            if not len(cells[0]):
+                continue
+            old = self.cells[cells]
+            old_classes, inverse = np.unique(old, return_inverse=True)
+            new_classes = np.array([self._class_of(self.classes[cls][0] | {region} if is_full else self.classes[cls][0],
+                                                   self.classes[cls][1] if is_full else self.classes[cls][1] | {region})
+                                    for cls in old_classes], dtype=np.uint32)
+            self.cells[cells] = new_classes[inverse]
+
+    def _box(self, low, high):
+        """index ranges of the cells overlapping [low, high), clipped to the map"""
+        start = np.clip(np.floor(np.asarray(low) / self.cell_size).astype(int), 0, self.shape)
+        stop = np.clip(np.ceil(np.asarray(high) / self.cell_size).astype(int), 0, self.shape)
+        return np.arange(start[0], stop[0]), np.arange(start[1], stop[1])
+
+    def _coverage(self, region):
+        """(full, partial) cells of a region as index tuples"""
+        if hasattr(region, 'loc'):  # a building is a product of intervals, so each axis can be done on its own
+            xs, ys = self._box(region.loc, region.loc + region.size)
+            full_x, full_y = [(region.loc[axis] <= cells * self.cell_size)
+                              & ((cells + 1) * self.cell_size <= region.loc[axis] + region.size)
+                              for axis, cells in enumerate((xs, ys))]
+            gx, gy = np.meshgrid(xs, ys, indexing='ij')
+            full = np.outer(full_x, full_y).ravel()
+            partial = ~full  # the box holds exactly the cells a building overlaps
+        else:
+            ports = np.array([protocol.pos for protocol in region.protocols], dtype=float)
+            xs, ys = self._box(ports.min(axis=0) - region.width - 1, ports.max(axis=0) + region.width + 1)
+            gx, gy = np.meshgrid(xs, ys, indexing='ij')
+            low = np.stack([gx.ravel(), gy.ravel()], axis=1) * self.cell_size
+            far = self.cell_size * (1 - 1e-9)  # the far edges of a cell are open
+            # a road is convex, so it covers a cell once it holds all four corners
+            full = np.logical_and.reduce([region.contains_many(low + (dx, dy)) for dx in (0, far) for dy in (0, far)])
+            partial = self._near_road(region, low + self.cell_size / 2) & ~full
+        flat_x, flat_y = gx.ravel(), gy.ravel()
+        return (flat_x[full], flat_y[full]), (flat_x[partial], flat_y[partial])
+
+    def _near_road(self, road, centres: np.ndarray) -> np.ndarray:
+        """cells whose centre is within half a cell diagonal of the road rectangle (a superset of its cells)"""
+        port1, port2 = [np.asarray(protocol.pos, dtype=float) for protocol in road.protocols]
+        length = np.hypot(*(port2 - port1))
+        along = (centres - port1) @ (port2 - port1) / length
+        across = np.abs((centres - port1) @ np.array([port1[1] - port2[1], port2[0] - port1[0]]) / length)
+        margin = _HALF_DIAGONAL * self.cell_size
+        return (-margin <= along) & (along <= length + margin) & (across < road.width + margin)
+
+    def classes_at(self, pos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """the class of every position, EMPTY off the raster, and the mask of those on it"""
+        cells = np.floor(np.asarray(pos) / self.cell_size).astype(np.int64)
+        on_map = np.all((0 <= cells) & (cells < self.shape), axis=-1)
+        res = np.full(cells.shape[:-1], EMPTY, dtype=np.int64)
+        res[on_map] = self.cells[cells[on_map, 0], cells[on_map, 1]]
+        return res, on_map
+
+    def contains(self, region_indices: np.ndarray, pos: np.ndarray) -> np.ndarray:
+        """batched membership test of pos[i] in region region_indices[i]"""
+        classes, on_map = self.classes_at(pos)
+        coverage = self.coverage_of(classes * len(self.vcity.region_table) + region_indices)
+        res = coverage == FULL
+        partial = np.flatnonzero((coverage == PARTIAL) | ~on_map)
+        for region in np.unique(region_indices[partial]):
+            members = partial[region_indices[partial] == region]
+            res[members] = self.vcity.region_table[region].contains_many(pos[members])
+        return res
+
+    def contains_one(self, region: int, pos) -> bool:
+        x, y = int(np.floor(pos[0] / self.cell_size)), int(np.floor(pos[1] / self.cell_size))
+        if not (0 <= x < self.shape[0] and 0 <= y < self.shape[1]):
+            return bool(self.vcity.region_table[region].contains_many(np.array([pos], float))[0])
+        full, partial = self.classes[self.cells[x, y]]
+        if region in full:
+            return True
+        return region in partial and bool(self.vcity.region_table[region].contains_many(np.array([pos], float))[0])
+
+    def outside_all(self, pos: np.ndarray) -> np.ndarray:
+        """mask of the positions that lie in no region at all"""
+        region_count = len(self.vcity.region_table)
+        classes, on_map = self.classes_at(pos)
+        has_full = np.zeros(len(self.classes), dtype=bool)
+        has_full[self.full_keys // region_count] = True
+        res = (classes == EMPTY) | ~has_full[classes]
+        off_map = np.flatnonzero(~on_map)
+        res[off_map] = ~np.logical_or.reduce([region.contains_many(pos[off_map]) for region in self.vcity.region_table]
+                                             + [np.zeros(len(off_map), dtype=bool)])
+        # the rest is in partial cells only: test every (position, partial region) pair
+        unsure = np.flatnonzero(res & (classes != EMPTY))
+        lo = np.searchsorted(self.partial_keys, classes[unsure] * region_count)
+        counts = np.searchsorted(self.partial_keys, (classes[unsure] + 1) * region_count) - lo
+        pair = np.repeat(np.arange(len(unsure)), counts)
+        key = self.partial_keys[lo[pair] + np.arange(len(pair)) - np.repeat(np.cumsum(counts) - counts, counts)]
+        inside = self.contains(key % region_count, pos[unsure[pair]])
+        res[unsure[np.unique(pair[inside])]] = False
+        return res
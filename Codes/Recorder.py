@@ -0,0 +1,83 @@
+import json
+import os
+import time
+import numpy as np
+TOTAL_COLUMNS = ('tick', 'day', 'time', 'normal', 'infected', 'transporting', 'new_infected')
+REGION_COLUMNS = ('region_normal', 'region_infected', 'region_transporting', 'region_new_infected')
+
+
+class MetricsRecorder:
+    """
+    Per-tick epidemic counts, in total and per region, kept in preallocated buffers and flushed every flush_every
+    ticks to one raw binary file per column in out_dir (described by schema.json, read back with load_metrics).
+    Attach with Simulation.recorder = MetricsRecorder(...); leave it None to disable recording entirely.
+    """
+    def __init__(self, sim, out_dir: str, flush_every: int = 1000):
+        self.out_dir = out_dir
+        self.flush_every = flush_every
+        self.region_count = len(sim.region_table)
+        self.buffers = {column: np.zeros(flush_every, dtype=np.int64) for column in TOTAL_COLUMNS}
+        self.buffers.update({column: np.zeros((flush_every, self.region_count), dtype=np.int32)
+                             for column in REGION_COLUMNS})
+        self.filled = 0
+        self.rows = 0
+        self.overhead = 0.  # seconds spent recording and flushing
+        self.started = time.perf_counter()
+
+        os.makedirs(out_dir, exist_ok=True)
+        schema = {column: {'dtype': buffer.dtype.str, 'row_shape': buffer.shape[1:]}
+                  for column, buffer in self.buffers.items()}
+        schema['region_names'] = [region.na for region in sim.region_table]
+        with open(os.path.join(out_dir, 'schema.json'), 'w') as file:
+            json.dump(schema, file)
+        for column in self.buffers:
+            open(os.path.join(out_dir, f'{column}.bin'), 'wb').close()
+
+    def record(self, sim):
+        start = time.perf_counter()
+        store = sim.store
+        current, infected = store.current[:store.count], store.infected[:store.count]
+        transporting = store.transporting[:store.count]
+        new_infected = np.asarray(sim.new_infected, dtype=np.int64)
+        row = self.filled
+        for column, value in (('tick', sim.elapsed_ticks), ('day', sim.current_day), ('time', sim.current_time),
+                              ('normal', store.count - infected.sum()), ('infected', infected.sum()),
+                              ('transporting', transporting.sum()), ('new_infected', len(new_infected))):
+            self.buffers[column][row] = value
+        self.buffers['region_infected'][row] = np.bincount(current[infected], minlength=self.region_count)
+        self.buffers['region_normal'][row] = np.bincount(current, minlength=self.region_count) \
+            - self.buffers['region_infected'][row]
+        self.buffers['region_transporting'][row] = np.bincount(current[transporting], minlength=self.region_count)
+        self.buffers['region_new_infected'][row] = np.bincount(current[new_infected], minlength=self.region_count)
+        self.filled += 1
+        self.rows += 1
+        if self.filled == self.flush_every:
+            self.flush()
+        self.overhead += time.perf_counter() - start
+
+    def flush(self):
+        for column, buffer in self.buffers.items():
+            with open(os.path.join(self.out_dir, f'{column}.bin'), 'ab') as file:
+                buffer[:self.filled].tofile(file)
+        self.filled = 0
+
+    def close(self):
+        start = time.perf_counter()
+        self.flush()
+        self.overhead += time.perf_counter() - start
+
+    @property
+    def overhead_fraction(self) -> float:
+        """share of the wall time since the recorder was attached that went into recording"""
+        return self.overhead / max(time.perf_counter() - self.started, 1e-12)
+
+
+def load_metrics(out_dir: str) -> dict[str, np.ndarray]:
+    with open(os.path.join(out_dir, 'schema.json')) as file:
+        schema = json.load(file)
+    res = {}
+    for column in TOTAL_COLUMNS + REGION_COLUMNS:
+        data = np.fromfile(os.path.join(out_dir, f'{column}.bin'), dtype=schema[column]['dtype'])
+        res[column] = data.reshape(-1, *schema[column]['row_shape'])
+    res['region_names'] = np.array(schema['region_names'])
+    return res
@@ -0,0 +1,88 @@
+import os
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.animation import writers
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import Rectangle
+from Objects import TIME_CONSTANT
+NORMAL_COLOR = np.array([0.12, 0.47, 0.71, 1.])
+INFECTED_COLOR = np.array([1., 0., 0., 1.])
+
+
+class CityRenderer:
+    """
+    Draws the static city once and afterwards only moves/recolours one scatter of all individuals.
+    Renders every `every`-th call of update() and at most `fps` times per second. With out_path None the frames go to
+    an interactive window; otherwise no GUI backend is used and the frames are written offline, either as a PNG
+    sequence (out_path is a directory) or as a video (out_path ends with a suffix of an available animation writer,
+    e.g. .mp4 with ffmpeg).
+    """
+    def __init__(self, sim, every: int = 1, fps: float = None, out_path: str = None, figsize=(10, 10), dpi=80):
+        self.sim = sim
+        self.every = every
+        self.min_interval = 1 / fps if fps else 0.
+        self.out_path = out_path
+        self.dpi = dpi
+        self.calls = 0
+        self.frames = 0
+        self.last_render = -np.inf
+
+        if out_path is None:
+            plt.ion()
+            self.figure = plt.figure(figsize=figsize, dpi=dpi)
+        else:
+            self.figure = Figure(figsize=figsize, dpi=dpi)
+            FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.draw_city()
+        self.scatter = self.axes.scatter(np.zeros(0), np.zeros(0), marker='o')
+
+        self.video = None
+        if out_path is not None:
+            suffix = os.path.splitext(out_path)[1].lstrip('.')
+            if suffix:
+                self.video = writers[{'mp4': 'ffmpeg', 'gif': 'pillow'}.get(suffix, suffix)](fps=fps or 30)
+                self.video.setup(self.figure, out_path, dpi)
+            else:
+                os.makedirs(out_path, exist_ok=True)
+
+    def draw_city(self):
+        self.axes.set_aspect(1)
+        self.axes.set_xlim(0, self.sim.size - 1)
+        self.axes.set_ylim(0, self.sim.size - 1)
+        for region in self.sim.buildings:
+            self.axes.add_artist(Rectangle(xy=tuple(region.loc), width=region.size, height=region.size, fill=False))
+        for road in self.sim.roads:
+            self.axes.add_artist(Line2D(xdata=[protocol.pos[0] for protocol in road.protocols],
+                                        ydata=[protocol.pos[1] for protocol in road.protocols],
+                                        linewidth=1, color='red', fillstyle='none', marker='x', markersize=10))
+
+    def update(self):
+        """called once per tick; draws only when the frame is due"""
+        self.calls += 1
+        now = time.perf_counter()
+        if (self.calls - 1) % self.every or now - self.last_render < self.min_interval:
+            return
+        self.last_render = now
+        self.render()
+
+    def render(self):
+        store = self.sim.store
+        self.scatter.set_offsets(store.pos[:store.count])
+        self.scatter.set_color(np.where(store.infected[:store.count, None], INFECTED_COLOR, NORMAL_COLOR))
+        self.axes.set_title(f'Day{self.sim.current_day} {self.sim.current_time // TIME_CONSTANT}:00')
+        if self.out_path is None:
+            self.figure.canvas.draw_idle()
+            self.figure.canvas.flush_events()
+        elif self.video is not None:
+            self.video.grab_frame()
+        else:
+            self.figure.savefig(os.path.join(self.out_path, f'frame_{self.frames:06d}.png'), dpi=self.dpi)
+        self.frames += 1
+
+    def close(self):
+        if self.video is not None:
+            self.video.finish()
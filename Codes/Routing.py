@@ -0,0 +1,82 @@
+from collections import deque
+import numpy as np
+UNREACHABLE = -1
+
+
+class RoutingTable:
+    """
+    The city graph compiled into integer form: regions are nodes, protocols are edges.
+    distance[region, column] is the shortest number of protocols from a region to the destination building of that
+    column (see dest_column), next_protocol[region, column] is the protocol to take first on such a shortest path.
+    """
+    def __init__(self, protocol_ends: np.ndarray, region_protocols: list[list[int]], destinations: np.ndarray,
+                 distance: np.ndarray = None, next_protocol: np.ndarray = None):
+        self.protocol_ends = np.asarray(protocol_ends, dtype=np.int32).reshape(-1, 2)
+        self.region_protocols = region_protocols  # protocol indices of every region, in Region.protocols order
+        self.destinations = np.asarray(destinations, dtype=np.int32)
+        self.dest_column = np.full(len(region_protocols), UNREACHABLE, dtype=np.int32)
+        self.dest_column[self.destinations] = np.arange(len(self.destinations))
+        # (protocol, neighbour) pairs of every region as plain ints, for the searches
+        self.adjacency = [[(protocol, self.other_side(protocol, region)) for protocol in protocols]
+                          for region, protocols in enumerate(region_protocols)]
+        # distance and next_protocol may be passed in from arrays() of an identical city to skip the searches
+        self.distance = self._all_distances() if distance is None else np.asarray(distance, dtype=np.int32)
+        self.next_protocol = self._next_hops() if next_protocol is None else np.asarray(next_protocol, dtype=np.int32)
+
+    @classmethod
+    def compile(cls, vcity, **tables) -> 'RoutingTable':
+        return cls(np.array([(protocol.region1.index, protocol.region2.index) for protocol in vcity.protocol_table]),
+                   [[protocol.index for protocol in region.protocols] for region in vcity.region_table],
+                   np.array([building.index for building in vcity.buildings]), **tables)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """the compiled tables, to be passed back to compile() as keyword arguments"""
+        return {'distance': self.distance, 'next_protocol': self.next_protocol}
+
+    def other_side(self, protocol: int, region: int) -> int:
+        end1, end2 = self.protocol_ends[protocol].tolist()
+        return end2 if region == end1 else end1
+
+    def bfs(self, source: int, removed_protocol: int = UNREACHABLE) -> list[int]:
+        """hop distances from source to every region, optionally without using one protocol"""
+        distance = [UNREACHABLE] * len(self.region_protocols)
+        distance[source] = 0
+        queue = deque([source])
+        while queue:
+            region = queue.popleft()
+            for protocol, neighbour in self.adjacency[region]:
+                if protocol != removed_protocol and distance[neighbour] == UNREACHABLE:
+                    distance[neighbour] = distance[region] + 1
+                    queue.append(neighbour)
+        return distance
+
+    def _all_distances(self) -> np.ndarray:
+        distance = np.full((len(self.region_protocols), len(self.destinations)), UNREACHABLE, dtype=np.int32)
+        for column, destination in enumerate(self.destinations):
+            distance[:, column] = self.bfs(destination)  # the graph is undirected
+        return distance
+
+    def _next_hops(self) -> np.ndarray:
+        next_protocol = np.full(self.distance.shape, UNREACHABLE, dtype=np.int32)
+        for region in range(len(self.region_protocols)):
+            here = self.distance[region]
+            for protocol, neighbour in reversed(self.adjacency[region]):  # earlier protocols win ties (old stable sort)
+                there = self.distance[neighbour]
+                next_protocol[region, (here > 0) & (there == here - 1)] = protocol
+        return next_protocol
+
+    def next_hop(self, region: int, destination: int) -> int:
+        column = self.dest_column[destination]
+        return UNREACHABLE if column == UNREACHABLE else self.next_protocol[region, column]
+
+    def accessible(self, region: int) -> dict[int, int]:
+        """{destination region index: distance} of every destination reachable from region"""
+        row = self.distance[region]
+        reachable = np.flatnonzero(row != UNREACHABLE)
+        return dict(zip(self.destinations[reachable].tolist(), row[reachable].tolist()))
+
+    def connect_distances(self, protocol: int, region: int) -> dict[int, int]:
+        """distances to destinations when leaving region through protocol (the old Protocol.connect_dict entry)"""
+        distance = self.bfs(self.other_side(protocol, region), removed_protocol=protocol)
+        return {int(destination): distance[destination] + 1 for destination in self.destinations
+                if distance[destination] != UNREACHABLE}
@@ -0,0 +1,152 @@
+"""
+Headless, config-driven runs, from this directory: python -m Run [config.json|config.toml] [--days N] [--seed S] ...
+Prints one JSON summary line and exits. matplotlib is imported only for --display or a video output.
+"""
+import time
+_STARTED = time.perf_counter()
+import argparse
+import json
+import os
+import sys
+from Objects import Simulation, TIME_CONSTANT
+from Cities import CACHE_DIR, load_city, read_toml
+from Tool import ConstantActivity
+from RandomStreams import RandomStreams
+DEFAULT_CITY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cities', 'test_city.json')
+DEFAULTS = {
+    'city': DEFAULT_CITY,        # city definition file, see Cities.read_definition
+    'city_cache': None,          # directory of compiled cities, None for .city_cache next to the city file
+    'population': 300,
+    'initial_infected': 20,
+    'time_period': [6, 20],      # simulated hours of a day
+    'step_length': 10,
+    'drift_sigma': 3,
+    'transport_activity': 0.1,   # constant share of the population transporting
+    'virus': {'infection_radius': 1.8, 'risk': 0.01},
+    'days': 30,
+    'seed': 0,
+    'fast_forward': False,
+    'transit': False,            # event-scheduled transit (Transit.TransitScheduler)
+    'display': False,
+    # output paths, None to skip: metrics (MetricsRecorder dir), events (EventLog dir), checkpoint (.npz),
+    # video (CityRenderer out_path) and summary (JSON file, besides stdout)
+    'outputs': {'metrics': None, 'events': None, 'checkpoint': None, 'video': None, 'summary': None},
+}
+
+
+def read_config(path: str = None) -> dict:
+    """DEFAULTS updated with a .json or .toml config; relative paths in it are relative to the config file"""
+    config = json.loads(json.dumps(DEFAULTS))
+    if path is None:
+        return config
+    if path.endswith('.toml'):
+        given = read_toml(path)
+    else:
+        with open(path) as file:
+            given = json.load(file)
+    unknown = set(given) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f'unknown config keys {sorted(unknown)}')
+    base = os.path.dirname(os.path.abspath(path))
+    for key, value in given.items():
+        if isinstance(DEFAULTS[key], dict):
+            unknown = set(value) - set(DEFAULTS[key])
+            if unknown:
+                raise ValueError(f'unknown config keys {sorted(f"{key}.{name}" for name in unknown)}')
+            config[key].update(value)
+        else:
+            config[key] = value
+    for key in ('city', 'city_cache'):
+        if given.get(key) is not None:
+            config[key] = os.path.join(base, config[key])
+    config['outputs'] = {name: value if value is None else os.path.join(base, value)
+                         for name, value in config['outputs'].items()}
+    return config
+
+
+def make_simulation(config: dict) -> Simulation:
+    """the compiled and populated simulation of a config"""
+    start, end = config['time_period']
+    sim = Simulation(time_period=(start * TIME_CONSTANT, end * TIME_CONSTANT), size=0,
+                     population=config['population'], initial_infected=config['initial_infected'],
+                     step_length=config['step_length'], drift_sigma=config['drift_sigma'],
+                     transport_activity=ConstantActivity(config['transport_activity']),
+                     infection_radius=config['virus']['infection_radius'], risk=config['virus']['risk'])
+    cache_dir = config['city_cache']
+    load_city(sim, config['city'], cache_dir if cache_dir is not None
+              else os.path.join(os.path.dirname(os.path.abspath(config['city'])), CACHE_DIR))
+    sim.streams = RandomStreams(config['seed'])
+    sim.fast_forward = config['fast_forward']
+    sim.initiate_individuals(sim.residential_buildings, sim.non_residential_buildings)
+    return sim
+
+
+def run(config: dict) -> dict:
+    """run a config to the end; returns the summary"""
+    outputs = config['outputs']
+    sim = make_simulation(config)
+    setup = time.perf_counter() - _STARTED
+    if config['transit']:
+        from Transit import TransitScheduler
+        sim.transit = TransitScheduler(sim)
+    if outputs['metrics']:
+        from Recorder import MetricsRecorder
+        sim.recorder = MetricsRecorder(sim, outputs['metrics'])
+    if outputs['events']:
+        from EventLog import EventLog
+        sim.event_log = EventLog(sim, outputs['events'])
+    renderer = None
+    if config['display'] or outputs['video']:
+        from Renderer import CityRenderer
+        renderer = CityRenderer(sim, every=5, fps=25 if config['display'] else None, out_path=outputs['video'])
+
+    ticks = 0
+    peak = peak_tick = first_tick = 0
+    loop_start = time.perf_counter()
+    while sim.current_day < config['days']:
+        ticks += sim.progress()
+        if first_tick == 0:
+            first_tick = time.perf_counter() - _STARTED
+        infected = len(sim.infected_individuals)
+        if infected > peak:
+            peak, peak_tick = infected, ticks
+        if renderer is not None:
+            renderer.update()
+    elapsed = time.perf_counter() - loop_start
+
+    for log in (sim.recorder, sim.event_log):
+        if log is not None:
+            log.close()
+    if renderer is not None:
+        renderer.close()
+    if outputs['checkpoint']:
+        sim.save_checkpoint(outputs['checkpoint'])
+    summary = {'ticks': ticks, 'days': sim.current_day, 'seconds': elapsed, 'ticks_per_second': ticks / elapsed,
+               'setup_seconds': setup, 'first_tick_seconds': first_tick, 'peak_infected': peak,
+               'peak_tick': peak_tick, 'final_normal': len(sim.normal_individuals),
+               'final_infected': len(sim.infected_individuals), 'population': sim.population, 'seed': config['seed']}
+    if outputs['summary']:
+        with open(outputs['summary'], 'w') as file:
+            json.dump(summary, file, indent=2)
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Run one simulation from a config and print a JSON summary')
+    parser.add_argument('config', nargs='?', help='.json or .toml run config (default: the built-in defaults)')
+    parser.add_argument('--days', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--population', type=int)
+    parser.add_argument('--display', action='store_true', help='show the city in a window while running')
+    args = parser.parse_args(argv)
+    config = read_config(args.config)
+    for key in ('days', 'seed', 'population'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    config['display'] = config['display'] or args.display
+    print(json.dumps(run(config)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def _function_key(building):
+    """buildings with the same key have the same attractiveness at any time"""
+    func = building.attract_func
+    if getattr(func, '__self__', None) is building and func.__func__ is type(building).default_attractiveness:
+        return func.__func__  # the class defaults depend on the time only
+    return func
+
+
+class AttractivenessSchedule:
+    """
+    The attractiveness of every building over the simulated part of a day, evaluated once per time unit and kept as
+    a piecewise-constant table: values[k] holds from change_times[k] up to the next change point.
+    Assumes attract_func depends on the time of day only (all of them in this repo do); compile again after
+    changing one.
+    """
+    def __init__(self, buildings, region_count: int, time_period: tuple):
+        self.start, self.end = time_period
+        times = np.arange(self.start, self.end + 1)
+        table = np.zeros((len(times), region_count))
+        evaluated = {}
+        for building in buildings:
+            key = _function_key(building)
+            if key not in evaluated:
+                evaluated[key] = np.array([building.attract_func(t) for t in times.tolist()], dtype=float)
+            table[:, building.index] = evaluated[key]
+        changed = np.ones(len(times), dtype=bool)
+        changed[1:] = np.any(table[1:] != table[:-1], axis=1)
+        self.change_times = times[changed]
+        self.values = table[changed]
+
+    def segment(self, current_time) -> int:
+        """the row of values at current_time, -1 outside time_period"""
+        if not self.start <= current_time <= self.end:
+            return -1
+        return int(np.searchsorted(self.change_times, current_time, side='right')) - 1
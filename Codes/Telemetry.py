@@ -0,0 +1,309 @@
+import asyncio
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import numpy as np
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+TEXT, BINARY, CLOSE, PING, PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+POSITIONS_HEADER = struct.Struct('<III')  # tick, day, number of individuals
+PONG_TIMEOUT = 5.  # seconds to wait for a client's pong before sending it the next snapshot anyway
+
+
+class Snapshot:
+    """the state of one tick as published by the simulation; never modified afterwards"""
+    __slots__ = ('version', 'tick', 'day', 'time', 'region_infected', 'positions')
+
+    def __init__(self, version, tick, day, time, region_infected, positions):
+        self.version = version
+        self.tick = tick
+        self.day = day
+        self.time = time
+        self.region_infected = region_infected
+        self.positions = positions  # a binary positions message, or None on ticks without positions
+
+
+class TelemetryServer:
+    """
+    A local HTTP/WebSocket endpoint streaming a running simulation, served by an asyncio loop in its own thread.
+    Attach with Simulation.telemetry = TelemetryServer(sim); publish() is then called once per progress().
+    publish() only stores an immutable Snapshot, and every client is sent the latest one whenever it is ready for
+    more, so slow (or many) clients skip ticks instead of blocking the simulation or working through a backlog.
+    "Ready" means it answered the ping that follows every snapshot (RFC 6455 clients answer pings in order), so at
+    most one snapshot per client is ever buffered anywhere; and at most max_rate snapshots a second are sent.
+
+    GET /         JSON description: region names, population, the address of the stream
+    GET /state    JSON of the latest snapshot
+    GET /stream   WebSocket; a JSON text message per snapshot sent
+                  {"tick", "day", "time", "infected", "regions": {region index: infected count}}
+                  with only the regions whose count changed since the previous message to this client (all of them in
+                  the first one), and, every positions_every ticks, a binary message: POSITIONS_HEADER, then
+                  float32 (x, y) and uint8 infected of at most max_positions individuals (a fixed stride sample).
+    """
+    def __init__(self, sim, host: str = '127.0.0.1', port: int = 0, positions_every: int = 0,
+                 max_positions: int = 2000, max_rate: float = 10.):
+        self.host = host
+        self.min_interval = 1 / max_rate if max_rate else 0.  # seconds between two messages to one client
+        self.positions_every = positions_every  # 0 for no positions
+        self.sample = np.arange(0, sim.store.count, max(1, -(-sim.store.count // max_positions)))
+        self.region_count = len(sim.region_table)
+        self.info = {'regions': [region.na for region in sim.region_table], 'population': sim.store.count,
+                     'positions_every': positions_every, 'sampled': len(self.sample)}
+        self.snapshot: Snapshot | None = None
+        self.published = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._event: asyncio.Event | None = None  # set and replaced whenever a new snapshot is out
+        self._stop: asyncio.Event | None = None
+        self._pending = False
+        self._clients: set[asyncio.Task] = set()
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._serve, args=(port, started), daemon=True, name='telemetry')
+        self.thread.start()
+        started.wait()
+        self.info['stream'] = f'ws://{self.host}:{self.port}/stream'
+
+    def publish(self, sim):
+        """called by the simulation thread after every progress()"""
+        store = sim.store
+        infected = store.infected[:store.count]
+        region_infected = np.bincount(store.current[:store.count][infected], minlength=self.region_count)
+        positions = None
+        if self.positions_every and self.published % self.positions_every == 0:
+            positions = POSITIONS_HEADER.pack(sim.elapsed_ticks, sim.current_day, len(self.sample)) \
+                + store.pos[self.sample].astype('<f4').tobytes() + infected[self.sample].astype(np.uint8).tobytes()
+        self.published += 1
+        self.snapshot = Snapshot(self.published, sim.elapsed_ticks, sim.current_day, sim.current_time,
+                                 region_infected, positions)  # one reference assignment, safe across threads
+        if not self._pending and not self.loop.is_closed():  # wake the clients at most once per loop iteration
+            self._pending = True
+            self.loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        self._pending = False
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self._stop.set)
+        self.thread.join()
+
+    # the server thread
+
+    def _serve(self, port: int, started: threading.Event):
+        asyncio.set_event_loop(self.loop)
+        self._event = asyncio.Event()
+        self._stop = asyncio.Event()
+
+        async def main():
+            server = await asyncio.start_server(self._handle, self.host, port)
+            self.port = server.sockets[0].getsockname()[1]
+            started.set()
+            async with server:
+                await self._stop.wait()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+        self.loop.run_until_complete(main())
+        self.loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(task := asyncio.current_task())
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            path = request[1] if len(request) > 1 else ''
+            if path == '/stream' and headers.get('upgrade', '').lower() == 'websocket':
+                await self._stream(reader, writer, headers['sec-websocket-key'])
+            elif path == '/':
+                await self._respond(writer, '200 OK', self.info)
+            elif path == '/state':
+                snapshot = self.snapshot
+                await self._respond(writer, '200 OK', self._message(snapshot, None) if snapshot else {})
+            else:
+                await self._respond(writer, '404 Not Found', {'error': path})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self._clients.discard(task)
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: str, body: dict):
+        data = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + data)
+        await writer.drain()
+
+    @staticmethod
+    def _message(snapshot: Snapshot, previous: np.ndarray | None) -> dict:
+        changed = np.arange(len(snapshot.region_infected)) if previous is None \
+            else np.flatnonzero(snapshot.region_infected != previous)
+        return {'tick': snapshot.tick, 'day': snapshot.day, 'time': snapshot.time,
+                'infected': int(snapshot.region_infected.sum()),
+                'regions': dict(zip(changed.tolist(), snapshot.region_infected[changed].tolist()))}
+
+    async def _stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: str):
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(f'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     f'Sec-WebSocket-Accept: {accept}\r\n\r\n'.encode())
+        await writer.drain()
+        # so that drain() soon holds back a slow client, instead of asyncio and the kernel queueing up old ticks
+        writer.transport.set_write_buffer_limits(high=1 << 14)
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 12)
+        pong = asyncio.Event()
+        closed = asyncio.ensure_future(self._read_until_close(reader, writer, pong))
+        stopping = asyncio.ensure_future(self._stop.wait())
+        sent_version, previous = 0, None
+        try:
+            while not closed.done() and not stopping.done():
+                snapshot = self.snapshot
+                if snapshot is None or snapshot.version == sent_version:
+                    waiter = asyncio.ensure_future(self._event.wait())
+                    await asyncio.wait([waiter, closed, stopping], return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    continue
+                writer.write(encode_frame(TEXT, json.dumps(self._message(snapshot, previous)).encode()))
+                if snapshot.positions is not None:
+                    writer.write(encode_frame(BINARY, snapshot.positions))
+                pong.clear()
+                writer.write(encode_frame(PING, b''))
+                await writer.drain()
+                sent_version, previous = snapshot.version, snapshot.region_infected
+                # a slow client holds back its own stream here, until it has read everything; the simulation never does
+                waiter = asyncio.ensure_future(pong.wait())
+                await asyncio.wait([waiter, closed, stopping], timeout=PONG_TIMEOUT,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if self.min_interval:
+                    await asyncio.wait([closed, stopping], timeout=self.min_interval)
+            if not closed.done():
+                writer.write(encode_frame(CLOSE, b''))
+                await writer.drain()
+        finally:
+            closed.cancel()
+            stopping.cancel()
+
+    @staticmethod
+    async def _read_until_close(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pong: asyncio.Event):
+        """answers pings, sets pong on pongs and ignores everything else the client sends, until it closes"""
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == CLOSE:
+                    break
+                if opcode == PING:
+                    writer.write(encode_frame(PONG, payload))
+                elif opcode == PONG:
+                    pong.set()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+
+def encode_frame(opcode: int, payload: bytes, mask: bytes = None) -> bytes:
+    """one final WebSocket frame; servers send unmasked frames, clients must pass a 4 byte mask"""
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, mask_bit | 127, length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        header += mask
+    return header + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+def decode_positions(message: bytes) -> tuple[int, int, np.ndarray, np.ndarray]:
+    """(tick, day, positions, infected) of a binary positions message"""
+    tick, day, count = POSITIONS_HEADER.unpack_from(message)
+    offset = POSITIONS_HEADER.size
+    positions = np.frombuffer(message, dtype='<f4', count=2 * count, offset=offset).reshape(count, 2)
+    infected = np.frombuffer(message, dtype=np.uint8, count=count, offset=offset + 8 * count).astype(bool)
+    return tick, day, positions, infected
+
+
+async def _client(url_port: int, messages: int, delay: float = 0., latest=None) -> list:
+    """
+    a minimal WebSocket client of /stream, collecting `messages` messages;
+    with latest(), a callable returning the tick the simulation is at, it records (message, lag in ticks) pairs
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', url_port)
+    key = base64.b64encode(b'telemetry client').decode()
+    writer.write(f'GET /stream HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                 f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'.encode())
+    while await reader.readline() not in (b'\r\n', b''):
+        pass
+    res = []
+    while len(res) < messages:
+        opcode, payload = await read_frame(reader)
+        if opcode == CLOSE:
+            break
+        if opcode == PING:
+            writer.write(encode_frame(PONG, payload, mask=b'mask'))
+            continue
+        message = json.loads(payload) if opcode == TEXT else decode_positions(payload)
+        if latest is not None and opcode == TEXT:
+            message = (message, latest() - message['tick'])
+        res.append(message)
+        await asyncio.sleep(delay)
+    writer.write(encode_frame(CLOSE, b'', mask=b'mask'))
+    writer.close()
+    return res
+
+
+def _collect(results: dict, name: str, *args):
+    results[name] = asyncio.run(_client(*args))
+
+
+if __name__ == '__main__':
+    class _Test:
+        import functools
+        import time
+        import urllib.request
+        from Objects import Simulation, TIME_CONSTANT
+        from Cities import build_test_city
+        sim = Simulation(time_period=(6 * TIME_CONSTANT, 20 * TIME_CONSTANT), size=1000, population=3000,
+                         initial_infected=200, step_length=10, drift_sigma=3, transport_activity=lambda t: 0.1,
+                         infection_radius=1.8, risk=0.01, seed=0)
+        build_test_city(sim)
+        sim.finish_construction()
+        sim.telemetry = TelemetryServer(sim, positions_every=50)
+        print(json.load(urllib.request.urlopen(f'http://127.0.0.1:{sim.telemetry.port}/'))['stream'])
+        results = {}
+        clients = []
+        latest = functools.partial(getattr, sim, 'elapsed_ticks')
+        for name, delay in (('fast', 0.), ('slow', 0.2)):  # the slow client takes 200ms per message
+            clients.append(threading.Thread(target=_collect,
+                                            args=(results, name, sim.telemetry.port, 30, delay, latest)))
+            clients[-1].start()
+        time.sleep(0.2)
+        start = time.perf_counter()
+        while any(client.is_alive() for client in clients):
+            sim.progress()
+        print(f'{sim.elapsed_ticks} ticks in {time.perf_counter() - start:.2f}s with two clients attached')
+        for name, received in results.items():
+            texts = [message for message in received if isinstance(message[0], dict)]
+            print(name, len(texts), 'deltas, ticks', texts[0][0]['tick'], '...', texts[-1][0]['tick'],
+                  'largest lag', max(lag for _, lag in texts), 'ticks,', len(received) - len(texts), 'position buffers')
+        print(json.load(urllib.request.urlopen(f'http://127.0.0.1:{sim.telemetry.port}/state'))['infected'])
+        sim.telemetry.close()
@@ -1,10 +1,21 @@
-import copy
-import random
-import time
-
 import numpy as np
 
 
+class ConstantActivity:
+    """a picklable constant transport_activity"""
+    def __init__(self, value: float):
+        self.value = value
+
+    def __call__(self, current_time):
+        return self.value
+
+    def __eq__(self, other):
+        return isinstance(other, ConstantActivity) and self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+
 def unit_vector(vector: np.ndarray) -> np.ndarray:
     temp = norm(vector)
     if temp != 0:
@@ -12,17 +23,20 @@ def unit_vector(vector: np.ndarray) -> np.ndarray:
     return np.array([0., 0.])
 
 
-def rand_rearrange(input_list: list):
+def unit_vectors(vectors: np.ndarray) -> np.ndarray:
+    """row-wise unit_vector; zero rows stay zero"""
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])[:, None]
+    return np.divide(vectors, lengths, out=np.zeros(vectors.shape), where=lengths != 0)
+
+
+def rand_rearrange(input_list: list, rng: np.random.Generator = None):
     """
     :param input_list: 输入列表
-    :return: None
+    :param rng: 随机数生成器
+    :return: 打乱后的新列表
     """
-    res = []
-    input_list = copy.copy(input_list)
-    while len(input_list) > 0:
-        random.seed(time.perf_counter())
-        res.append(input_list.pop(random.randint(0, len(input_list) - 1)))
-    return res
+    rng = rng if rng is not None else np.random.default_rng()
+    return [input_list[i] for i in rng.permutation(len(input_list))]
 
 
 def norm(input_array: np.ndarray) -> float:
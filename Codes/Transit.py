@@ -0,0 +1,122 @@
+import heapq
+import numpy as np
+from Population import NO_REGION
+
+
+class TransitScheduler:
+    """
+    Event-scheduled movement of the transporting individuals. On departure a trip is compiled once into its waypoint
+    polyline (the protocols of the shortest route, from RoutingTable.next_protocol) with the tick every leg ends at,
+    a leg of length d taking ceil(d / step_length) ticks as stepping does. Every protocol crossing is pushed to a
+    priority queue keyed by tick, so a tick only handles the crossings due then; in between, a traveller's position
+    is interpolated along its current leg, which is all the contact detection needs. Nobody steps, polls
+    containment or looks up a protocol per tick.
+
+    Attach with Crowd.transit = TransitScheduler(crowd) after populating. Travellers follow their polyline exactly
+    (drift only moves settled individuals) and arrive at the door of their target. state()/load_state() carry the
+    legs and pending crossings through Simulation checkpoints.
+    """
+    def __init__(self, crowd):
+        self.crowd = crowd
+        capacity = crowd.store.capacity
+        self.tick = 0
+        self.leg_from = np.zeros((capacity, 2))
+        self.leg_to = np.zeros((capacity, 2))
+        self.leg_start = np.zeros(capacity, dtype=np.int64)
+        self.leg_end = np.ones(capacity, dtype=np.int64)
+        # (tick, individual, protocol crossed, the tick the next leg ends at, the protocol it ends at)
+        self.events: list[tuple[int, int, int, int, int]] = []
+        store = crowd.store
+        self.depart(np.flatnonzero(store.transporting[:store.count] & (store.target[:store.count] != NO_REGION)))
+
+    def state(self) -> dict[str, np.ndarray]:
+        """the clock, the legs of the filled rows and the event heap (in heap order)"""
+        count = self.crowd.store.count
+        return {'tick': np.array(self.tick), 'leg_from': self.leg_from[:count], 'leg_to': self.leg_to[:count],
+                'leg_start': self.leg_start[:count], 'leg_end': self.leg_end[:count],
+                'events': np.array(self.events, dtype=np.int64).reshape(-1, 5)}
+
+    def load_state(self, state: dict[str, np.ndarray]):
+        self.tick = int(state['tick'])
+        count = len(state['leg_from'])
+        for column in ('leg_from', 'leg_to', 'leg_start', 'leg_end'):
+            getattr(self, column)[:count] = state[column]
+        self.events = [tuple(event) for event in np.asarray(state['events']).tolist()]
+
+    def depart(self, individuals: np.ndarray):
+        """compile the trips of individuals whose target and first protocol are set (see Crowd.depart_all)"""
+        store, vcity = self.crowd.store, self.crowd.vcity
+        routing = vcity.routing
+        # the protocols of every route, one hop after the other; routes of different length end in NO_REGION
+        protocols = [store.target_protocol[individuals]]
+        region = store.imagined[individuals]
+        column = routing.dest_column[store.target[individuals]]
+        while True:
+            on_way = region != store.target[individuals]
+            if not on_way.any():
+                break
+            protocol = np.full(len(individuals), NO_REGION, dtype=np.int32)
+            protocol[on_way] = routing.next_protocol[region[on_way], column[on_way]]
+            ends = routing.protocol_ends[protocol[on_way]]
+            region[on_way] = np.where(ends[:, 0] == region[on_way], ends[:, 1], ends[:, 0])
+            protocols.append(protocol)
+        protocols = np.stack(protocols, axis=1)
+        valid = protocols != NO_REGION
+        waypoints = vcity.protocol_pos[protocols]
+        previous = np.concatenate([store.pos[individuals, None], waypoints[:, :-1]], axis=1)
+        length = np.hypot(*(waypoints - previous).transpose(2, 0, 1))
+        ticks = self.tick + np.cumsum(np.where(valid, np.maximum(np.ceil(length / self.crowd.step_length), 1), 0),
+                                      axis=1).astype(np.int64)
+
+        self.leg_from[individuals] = store.pos[individuals]
+        self.leg_to[individuals] = waypoints[:, 0]
+        self.leg_start[individuals] = self.tick
+        self.leg_end[individuals] = ticks[:, 0]
+        following = np.concatenate([protocols[:, 1:], np.full((len(individuals), 1), NO_REGION)], axis=1)
+        following_ticks = np.concatenate([ticks[:, 1:], ticks[:, -1:]], axis=1)
+        row, hop = np.nonzero(valid)
+        for event in zip(ticks[row, hop].tolist(), individuals[row].tolist(), protocols[row, hop].tolist(),
+                         following_ticks[row, hop].tolist(), following[row, hop].tolist()):
+            heapq.heappush(self.events, event)
+
+    def advance(self) -> tuple[int, int]:
+        """
+        One tick: fire the crossings due and put every traveller at its interpolated position.
+        :return: the number of arrivals and of other crossings
+        """
+        self.tick += 1
+        crowd = self.crowd
+        store, views, vcity = crowd.store, crowd.views, crowd.vcity
+        due = []
+        while self.events and self.events[0][0] <= self.tick:
+            due.append(heapq.heappop(self.events))
+        arrivals = 0
+        if due:
+            tick, individuals, _, next_tick, next_protocol = map(np.array, zip(*due))
+            for i in individuals.tolist():  # the region crossed into is the imagined one
+                view = views[i]
+                view.current_region.remove_individual(view)
+                view.imagined_current_region.add_individual(view)
+            current = store.imagined[individuals]
+            store.current[individuals] = current
+            arrived = next_protocol == NO_REGION
+            done = individuals[arrived]
+            store.pos[done] = self.leg_to[done]
+            store.target[done] = NO_REGION
+            store.target_protocol[done] = NO_REGION
+            store.transporting[done] = False
+            arrivals = len(done)
+
+            on_way, current, next_protocol = individuals[~arrived], current[~arrived], next_protocol[~arrived]
+            ends = vcity.routing.protocol_ends[next_protocol]
+            store.target_protocol[on_way] = next_protocol
+            store.imagined[on_way] = np.where(ends[:, 0] == current, ends[:, 1], ends[:, 0])
+            self.leg_from[on_way] = self.leg_to[on_way]
+            self.leg_to[on_way] = vcity.protocol_pos[next_protocol]
+            self.leg_start[on_way] = tick[~arrived]
+            self.leg_end[on_way] = next_tick[~arrived]
+
+        moving = np.flatnonzero(store.transporting[:store.count])
+        share = np.clip((self.tick - self.leg_start[moving]) / (self.leg_end[moving] - self.leg_start[moving]), 0, 1)
+        store.pos[moving] = self.leg_from[moving] + share[:, None] * (self.leg_to[moving] - self.leg_from[moving])
+        return arrivals, len(due) - arrivals